@@ -1,73 +1,212 @@
+import asyncio
 import json
 import os
 import logging
+import tempfile
+import time
 from dotenv import load_dotenv
 
+from utils.logs import setup_logging
+
 load_dotenv()
 BOT_OWNER_ID = int(os.getenv("BOT_OWNER_ID", ""))
+# Changes arriving within this many seconds are written to disk together
+AUTH_SAVE_DELAY = float(os.getenv("AUTH_SAVE_DELAY", 1))
 
-# Setup logging for auth module
-file_handler = logging.FileHandler('auth.log')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-
+# Shared with noor.py: one queue-backed setup for the whole process, writing bot.log
+setup_logging()
 logger = logging.getLogger("terabox_bot")
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
 
 # ফাইল পাথ
 AUTHORIZED_USERS_FILE = os.path.abspath("authorized_users.json")
 logger.info(f"Authorized users file path: {AUTHORIZED_USERS_FILE}")
 
-# ইউজার লোড
-if os.path.exists(AUTHORIZED_USERS_FILE):
-    try:
-        with open(AUTHORIZED_USERS_FILE, "r") as f:
-            AUTHORIZED_USERS = json.load(f)
-        logger.info(f"Loaded authorized users: {AUTHORIZED_USERS}")
-    except Exception as e:
-        AUTHORIZED_USERS = []
-        logger.warning(f"Failed to load users: {str(e)}. Initializing empty list.")
-else:
-    AUTHORIZED_USERS = []
-    logger.info("No user file found, initializing empty list")
-
-"""
-def add_authorized_user(user_id: int) -> bool:
-    if user_id in AUTHORIZED_USERS:
-        logger.info(f"User {user_id} already authorized")
-        return False
-    AUTHORIZED_USERS.append(user_id)
-    return save_users()
-"""
+DAY = 86400
+
+
+class AuthStore:
+    """Authorized users held in memory, persisted to a JSON file
+
+    Membership is a set so checks stay O(1) however long the list gets.
+    Users may carry an ``expires`` timestamp and a daily file ``quota``;
+    both live in a side dict that only holds users who have them. Writes
+    go to a temp file that is renamed over the old one, off the event
+    loop, and a burst of changes becomes a single write.
+    """
+
+    def __init__(self, path=AUTHORIZED_USERS_FILE, owner_id=BOT_OWNER_ID, save_delay=AUTH_SAVE_DELAY):
+        self.path = path
+        self.owner_id = owner_id
+        self.save_delay = save_delay
+        self.users = set()
+        self.meta = {}  # user_id -> {"expires": ts, "quota": n, "used": n, "day": n}
+        self.saves = 0
+        self._dirty = False
+        self._saver = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            logger.info("No user file found, initializing empty list")
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load users: {str(e)}. Initializing empty list.")
+            return
+        if isinstance(data, list):
+            # Old format: a plain list of IDs
+            self.users = {int(uid) for uid in data}
+        else:
+            for uid, fields in data.get("users", {}).items():
+                self.users.add(int(uid))
+                if fields:
+                    self.meta[int(uid)] = dict(fields)
+        logger.info(f"Loaded {len(self.users)} authorized users")
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return self.is_authorized(user_id)
+
+    def is_authorized(self, user_id):
+        if user_id == self.owner_id:
+            return True
+        if user_id not in self.users:
+            return False
+        fields = self.meta.get(user_id)
+        if fields and fields.get("expires") and fields["expires"] <= time.time():
+            logger.info(f"⌛ Authorization of {user_id} expired")
+            self.remove(user_id)
+            return False
+        return True
+
+    def add(self, user_ids, expires=None, quota=None):
+        """Authorize users; returns the IDs that weren't authorized before"""
+        added = []
+        for user_id in user_ids:
+            user_id = int(user_id)
+            if user_id not in self.users:
+                self.users.add(user_id)
+                added.append(user_id)
+            if expires is not None or quota is not None:
+                fields = self.meta.setdefault(user_id, {})
+                if expires is not None:
+                    fields["expires"] = expires
+                if quota is not None:
+                    fields["quota"] = quota
+        if added or expires is not None or quota is not None:
+            self._changed()
+        return added
+
+    def remove(self, user_ids):
+        """Revoke users; returns the IDs that were authorized"""
+        if isinstance(user_ids, int):
+            user_ids = [user_ids]
+        removed = []
+        for user_id in user_ids:
+            user_id = int(user_id)
+            if user_id in self.users:
+                self.users.discard(user_id)
+                removed.append(user_id)
+            self.meta.pop(user_id, None)
+        if removed:
+            self._changed()
+        return removed
+
+    def remaining(self, user_id):
+        """Files the user may still send today; None means no quota"""
+        fields = self.meta.get(user_id)
+        if user_id == self.owner_id or not fields or not fields.get("quota"):
+            return None
+        if fields.get("day") != int(time.time() // DAY):
+            return fields["quota"]
+        return max(0, fields["quota"] - fields.get("used", 0))
+
+    def charge(self, user_id, count=1):
+        fields = self.meta.get(user_id)
+        if user_id == self.owner_id or not fields or not fields.get("quota"):
+            return
+        today = int(time.time() // DAY)
+        if fields.get("day") != today:
+            fields.update(day=today, used=0)
+        fields["used"] = fields.get("used", 0) + count
+        self._changed()
+
+    def details(self, user_id):
+        return dict(self.meta.get(user_id, {}))
+
+    def _changed(self):
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop yet (startup, scripts): nothing to block, write now
+            self._write(self._snapshot())
+            self._dirty = False
+            return
+        if self._saver is None or self._saver.done():
+            self._saver = loop.create_task(self._save_later())
+
+    def _snapshot(self):
+        # Copies, so the writer thread never sees a dict the loop is changing
+        return {"users": {str(uid): dict(self.meta[uid]) if uid in self.meta else {} for uid in self.users}}
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        while self._dirty:
+            self._dirty = False
+            snapshot = self._snapshot()
+            try:
+                await asyncio.to_thread(self._write, snapshot)
+            except Exception as e:
+                logger.error(f"❌ Error saving user list: {str(e)}")
+                self._dirty = True
+                await asyncio.sleep(self.save_delay * 5)
+
+    async def flush(self):
+        """Write any pending change now (shutdown)"""
+        if self._saver and not self._saver.done():
+            self._saver.cancel()
+        if self._dirty:
+            self._dirty = False
+            await asyncio.to_thread(self._write, self._snapshot())
+
+    def _write(self, snapshot):
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(prefix=".authorized_users.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates 0600; keep the mode the file had (0644 for a new one)
+            try:
+                mode = os.stat(self.path).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp, mode)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.saves += 1
+        logger.info(f"✅ Saved {len(snapshot['users'])} users to {self.path}")
+
+
+store = AuthStore()
+
+
 def add_authorized_user(user_id: int) -> bool:
-    user_id = int(user_id)  # Ensure it's stored as integer
-    if user_id in AUTHORIZED_USERS:
-        logger.info(f"User {user_id} already authorized")
-        return False
-    AUTHORIZED_USERS.append(user_id)
-    return save_users()
+    return bool(store.add([user_id]))
 
 def remove_authorized_user(user_id: int) -> bool:
-    if user_id not in AUTHORIZED_USERS:
-        logger.info(f"User {user_id} not found in list")
-        return False
-    AUTHORIZED_USERS.remove(user_id)
-    return save_users()
-
-def save_users() -> bool:
-    try:
-        with open(AUTHORIZED_USERS_FILE, "w") as f:
-            json.dump(AUTHORIZED_USERS, f)
-        logger.info("✅ User list saved successfully")
-        logger.info(f"✅ Saved to path: {AUTHORIZED_USERS_FILE}")  # ⬅️ এই লাইনটি যোগ করো
-        return True
-    except Exception as e:
-        logger.error(f"❌ Error saving user list: {str(e)}")
-        return False
+    return bool(store.remove([user_id]))
 
 def is_authorized(user_id: int) -> bool:
-    return user_id == BOT_OWNER_ID or user_id in AUTHORIZED_USERS
+    return store.is_authorized(user_id)
 
 def get_authorized_users() -> list:
-    logger.info(f"Returning authorized users: {AUTHORIZED_USERS}")
-    return AUTHORIZED_USERS
+    return sorted(store.users)
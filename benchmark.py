@@ -0,0 +1,413 @@
+"""Offline end-to-end benchmark for the download/upload pipeline
+
+Runs noor.message_handler/process_terabox against local stand-ins: a fake
+TERABOX_API, a throttled HTTP file host and a mock Telegram client that
+records edits and uploads and can inject FloodWait. Nothing leaves the
+machine; each run works in a fresh temporary directory.
+
+    python benchmark.py --jobs 20 --concurrency 4 --size 50 --bandwidth 4096
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import psutil
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BLOCK = random.Random(0).randbytes(1024 * 1024)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class TokenBucket:
+    """Shared byte budget per second; rate 0 means unlimited"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._allowance = rate
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def take(self, nbytes):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                if self._allowance >= nbytes or self._allowance >= self.rate:
+                    self._allowance -= nbytes
+                    return
+                await asyncio.sleep((nbytes - self._allowance) / self.rate)
+
+
+class FakeTerabox:
+    """Fake resolver API plus a Range-capable file host with bandwidth and latency controls"""
+
+    def __init__(self, size, latency=0.0, bandwidth=0, host_bandwidth=0, extension="bin", folder_files=0):
+        self.size = size
+        self.folder_files = folder_files
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host_bucket = TokenBucket(host_bandwidth)
+        self.extension = extension
+        self.base = None
+        self.api_calls = 0
+        self.file_requests = 0
+        self.bytes_served = 0
+        self.app = web.Application()
+        self.app.router.add_get("/api", self.api)
+        self.app.router.add_get("/files/{name}", self.files)
+        self.app.router.add_get("/thumb.jpg", self.thumb)
+        self._runner = None
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def api(self, request):
+        self.api_calls += 1
+        await asyncio.sleep(self.latency)
+        share = re.search(r"/s/([a-zA-Z0-9_-]+)", request.query.get("url", ""))
+        if not share:
+            return web.json_response({"error": "bad link"}, status=400)
+        if self.folder_files:
+            return web.json_response({"files": [self._file(f"{share.group(1)}_{i}") for i in range(self.folder_files)]})
+        return web.json_response(self._file(share.group(1)))
+
+    def _file(self, stem):
+        name = f"{stem}.{self.extension}"
+        return {
+            "file_name": name,
+            "proxy_url": f"{self.base}/files/{name}",
+            "size_bytes": self.size,
+            "thumbnail": f"{self.base}/thumb.jpg",
+        }
+
+    async def thumb(self, request):
+        return web.Response(body=BLOCK[:4096], content_type="image/jpeg")
+
+    async def files(self, request):
+        self.file_requests += 1
+        await asyncio.sleep(self.latency)
+        start, end = 0, self.size - 1
+        status = 200
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else end, self.size - 1)
+            status = 206
+        response = web.StreamResponse(status=status, headers={"Accept-Ranges": "bytes"})
+        response.content_length = end - start + 1
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{self.size}"
+        await response.prepare(request)
+        bucket = TokenBucket(self.bandwidth)
+        offset = start
+        while offset <= end:
+            chunk = min(64 * 1024, end - offset + 1)
+            await bucket.take(chunk)
+            await self.host_bucket.take(chunk)
+            block_offset = offset % len(BLOCK)
+            data = BLOCK[block_offset:block_offset + chunk]
+            if len(data) < chunk:
+                data += BLOCK[:chunk - len(data)]
+            await response.write(data)
+            self.bytes_served += chunk
+            offset += chunk
+        await response.write_eof()
+        return response
+
+
+class Media:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class MockMessage:
+    """The parts of pyrogram.types.Message the bot touches"""
+
+    def __init__(self, client, chat_id, msg_id, text="", user_id=None):
+        self._client = client
+        self.id = msg_id
+        self.chat = type("Chat", (), {"id": chat_id})()
+        self.from_user = type("User", (), {"id": user_id})()
+        self.text = text
+        self.empty = False
+        self.video = None
+        self.document = None
+
+    async def reply(self, text, **kwargs):
+        return self._client.new_message(self.chat.id)
+
+    async def edit_text(self, text, **kwargs):
+        await self._client.edit(self, text)
+
+    async def delete(self):
+        self._client.deleted += 1
+
+    async def reply_document(self, document, progress=None, **kwargs):
+        return await self._client.upload(self, document, progress, "document")
+
+    async def reply_video(self, video, progress=None, **kwargs):
+        return await self._client.upload(self, video, progress, "video")
+
+
+class MockClient:
+    """Records edits and uploads; injects FloodWait on a share of edits"""
+
+    def __init__(self, flood_rate=0.0, flood_seconds=1, upload_rate=0, part_size=512 * 1024):
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.upload_bucket = TokenBucket(upload_rate)
+        self.part_size = part_size
+        self._ids = iter(range(1, 10 ** 9))
+        self._random = random.Random(1)
+        self.edits = 0
+        self.flood_waits = 0
+        self.deleted = 0
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.cached_sends = 0
+        self.delivered = []  # (chat_id, monotonic time) per delivered file
+
+    def new_message(self, chat_id, text="", user_id=None):
+        return MockMessage(self, chat_id, next(self._ids), text, user_id)
+
+    async def edit(self, message, text):
+        from pyrogram.errors import FloodWait
+
+        if self._random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_seconds)
+        self.edits += 1
+
+    async def upload(self, message, path, progress, kind):
+        from pyrogram import StopTransmission
+
+        if isinstance(path, str) and not os.path.exists(path):
+            # A file_id re-send: delivered without uploading anything
+            self.cached_sends += 1
+            self.delivered.append((message.chat.id, time.monotonic()))
+            return self.new_message(message.chat.id)
+        # Split parts arrive as file objects (FileSlice)
+        total = os.path.getsize(path) if isinstance(path, str) else path.seek(0, os.SEEK_END)
+        current = 0
+        # Same shape as Pyrogram: sequential part reads with a progress call per part
+        with open(path, "rb") if isinstance(path, str) else contextlib.nullcontext(path) as f:
+            f.seek(0)
+            while current < total:
+                chunk = f.read(self.part_size)
+                if not chunk:
+                    break
+                await self.upload_bucket.take(len(chunk))
+                current += len(chunk)
+                if progress:
+                    try:
+                        await progress(current, total)
+                    except StopTransmission:
+                        return None
+                else:
+                    await asyncio.sleep(0)
+        self.uploads += 1
+        self.upload_bytes += total
+        self.delivered.append((message.chat.id, time.monotonic()))
+        sent = self.new_message(message.chat.id)
+        setattr(sent, kind, Media(f"bench-{sent.id}"))
+        return sent
+
+
+class Sampler:
+    """Event-loop lag plus peak RSS and disk use, sampled in the background"""
+
+    def __init__(self, download_dir, interval=0.05):
+        self.download_dir = download_dir
+        self.interval = interval
+        self.lags = []
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._process = psutil.Process()
+
+    async def run(self):
+        from utils.disk import allocated_bytes
+
+        loop = asyncio.get_running_loop()
+        while True:
+            self.peak_rss = max(self.peak_rss, self._process.memory_info().rss)
+            self.peak_disk = max(self.peak_disk, allocated_bytes(self.download_dir))
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+
+def configure_env(args, workdir, api_base):
+    os.environ.update({
+        "API_ID": "1",
+        "API_HASH": "bench",
+        "BOT_TOKEN": "1:bench",
+        "BOT_OWNER_ID": "1",
+        "TERABOX_API": f"{api_base}/api?url=",
+        "DOWNLOAD_ENGINE": args.engine,
+        "PIPELINE_UPLOADS": str(args.pipeline),
+        "MAX_CONCURRENT_JOBS": str(args.concurrency),
+        "MAX_QUEUE_SIZE": str(max(args.jobs, 50)),
+        "FILE_INDEX_DB": os.path.join(workdir, "file_index.db"),
+        "JOB_JOURNAL_DB": os.path.join(workdir, "jobs.db"),
+        "FILE_CACHE_SIZE": "0",
+        "LOG_CHANNEL_ID": "",
+        "UPLOADER_BOT_TOKENS": "",
+        "UPLOADER_SESSION_STRINGS": "",
+    })
+    if args.no_media_tools:
+        # Drop every PATH entry that holds ffmpeg/ffprobe so jobs run as on a host without them
+        os.environ["PATH"] = os.pathsep.join(
+            d for d in os.environ.get("PATH", "").split(os.pathsep)
+            if not any(os.path.exists(os.path.join(d, tool)) for tool in ("ffmpeg", "ffprobe"))
+        )
+
+
+async def run(args):
+    server = FakeTerabox(
+        args.size * 1024 * 1024, latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1024, host_bandwidth=args.host_bandwidth * 1024,
+        extension="mp4" if args.video else "bin", folder_files=args.folder_files,
+    )
+    await server.start()
+    workdir = tempfile.mkdtemp(prefix="terabox_bench_")
+    configure_env(args, workdir, server.base)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+
+    import noor
+    import auth
+    from utils.upload_pool import UploadPool
+
+    if not args.verbose:
+        noor.logger.setLevel("WARNING")
+    client = MockClient(args.flood_rate, args.flood_seconds, args.upload_bandwidth * 1024)
+    # The mock stands in for the main bot; helper sessions are out of scope here
+    noor.upload_pool = UploadPool(client)
+    os.makedirs(noor.DOWNLOAD_DIR, exist_ok=True)
+
+    sampler = Sampler(noor.DOWNLOAD_DIR)
+    sampler_task = asyncio.create_task(sampler.run())
+    started = {}
+    began = time.monotonic()
+
+    if args.batch:
+        # Every link in one message from one user: a single batch
+        auth.store.users.add(1000)
+        text = "\n".join(f"https://terabox.com/s/bench{i}" for i in range(args.jobs))
+        started[1000] = time.monotonic()
+        await noor.message_handler(client, client.new_message(1000, text, 1000))
+
+    # One user per job so the per-user limit doesn't serialise the run
+    for i in range(0 if args.batch else args.jobs):
+        user_id = 1000 + i
+        auth.store.users.add(user_id)
+        share = f"bench{i}" if args.unique else "bench"
+        incoming = client.new_message(user_id, f"https://terabox.com/s/{share}", user_id)
+        started[user_id] = time.monotonic()
+        await noor.message_handler(client, incoming)
+        if args.interval:
+            await asyncio.sleep(args.interval)
+
+    while noor.scheduler.active or noor.scheduler.queue_depth:
+        await asyncio.sleep(0.1)
+    elapsed = time.monotonic() - began
+    sampler_task.cancel()
+    await server.stop()
+    await noor.resolver.close()
+
+    times = [at - started[chat] for chat, at in client.delivered]
+    report = {
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "engine": args.engine,
+        "file_mb": args.size,
+        "succeeded": noor.metrics.jobs_total.get(outcome="success"),
+        "served_from_index": noor.metrics.jobs_total.get(outcome="cached"),
+        "failed": noor.metrics.jobs_total.get(outcome="failed"),
+        "elapsed_s": round(elapsed, 2),
+        "jobs_per_min": round(len(times) / elapsed * 60, 2) if elapsed else 0,
+        "time_to_file_p50_s": round(percentile(times, 50), 2),
+        "time_to_file_p95_s": round(percentile(times, 95), 2),
+        "loop_lag_p95_ms": round(percentile(sampler.lags, 95) * 1000, 1),
+        "loop_lag_max_ms": round(max(sampler.lags, default=0) * 1000, 1),
+        "loop_lag_mean_ms": round(statistics.fmean(sampler.lags) * 1000, 2) if sampler.lags else 0,
+        "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+        "peak_disk_mb": round(sampler.peak_disk / 1024 / 1024, 1),
+        "edits": client.edits,
+        "flood_waits_injected": client.flood_waits,
+        "uploaded_mb": round(client.upload_bytes / 1024 / 1024, 1),
+        "file_id_resends": client.cached_sends,
+        "api_calls": server.api_calls,
+        "served_mb": round(server.bytes_served / 1024 / 1024, 1),
+    }
+    if not args.keep:
+        import shutil
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for the Terabox bot")
+    parser.add_argument("--jobs", type=int, default=10, help="links to submit")
+    parser.add_argument("--concurrency", type=int, default=3, help="MAX_CONCURRENT_JOBS")
+    parser.add_argument("--size", type=int, default=20, help="file size in MB")
+    parser.add_argument("--bandwidth", type=int, default=0, help="per-connection download KB/s (0 = unlimited)")
+    parser.add_argument("--host-bandwidth", type=int, default=0, help="total file host KB/s (0 = unlimited)")
+    parser.add_argument("--upload-bandwidth", type=int, default=0, help="mock Telegram upload KB/s (0 = unlimited)")
+    parser.add_argument("--latency", type=int, default=0, help="API and file host latency in ms")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of edits answered with FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="FloodWait length")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between submitted links")
+    parser.add_argument("--engine", choices=("python", "aria2"), default="python", help="DOWNLOAD_ENGINE")
+    parser.add_argument("--pipeline", action="store_true", help="enable PIPELINE_UPLOADS")
+    parser.add_argument("--video", action="store_true", help="serve .mp4 names (probed with ffmpeg/ffprobe)")
+    parser.add_argument("--no-media-tools", action="store_true",
+                        help="hide ffmpeg/ffprobe from PATH; video jobs must still succeed")
+    parser.add_argument("--batch", action="store_true", help="send all links in one message")
+    parser.add_argument("--folder-files", type=int, default=0, help="answer every link as a folder of N files")
+    parser.add_argument("--no-unique", dest="unique", action="store_false", help="submit the same link every time")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary work directory")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        width = max(len(k) for k in report)
+        for key, value in report.items():
+            print(f"{key.ljust(width)}  {value}")
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
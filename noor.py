@@ -1,23 +1,44 @@
 import os
 import time
 import shutil
+import tempfile
 import traceback
 import logging
 import json
 import re
-import requests
+import html
 import asyncio
-from threading import Thread
-from urllib.parse import quote
 from pyrogram.enums import ParseMode
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import FloodWait
+from pyrogram import StopTransmission
 from dotenv import load_dotenv
-from flask import Flask, render_template
-from auth import add_authorized_user, remove_authorized_user, is_authorized, AUTHORIZED_USERS, AUTHORIZED_USERS_FILE
-from auth import BOT_OWNER_ID, get_authorized_users
-from utils.duration import get_video_duration, sanitize_filename
+from auth import is_authorized, AUTHORIZED_USERS_FILE, BOT_OWNER_ID, get_authorized_users
+from auth import store as auth_store
+from utils.duration import sanitize_filename
+from utils.resolver import TeraboxResolver, ResolverError
+from utils.file_index import FileIndex
+from utils.scheduler import JobScheduler, QueueFullError, PRIORITY_OWNER, PRIORITY_USER
+from utils.aria2 import Aria2Engine, Aria2Error, ARIA2_GLOBAL_LIMIT
+from utils.segmented import SegmentedDownloader, SegmentedDownloadError
+from utils.pipeline import ByteWatermark
+from utils.progress import ProgressEditor
+from utils.log_channel import LogChannelMirror
+from utils import media
+from utils.splitter import byte_parts, video_parts, part_count
+from utils.upload_pool import UploadPool, build_helper_clients, UPLOAD_TRANSMISSIONS
+from utils.journal import JobJournal
+from utils.disk import DiskAdmission, DiskFullError, FileCache
+from utils import metrics
+from utils.web import WebServer
+from utils.profiler import BlockingDetector, SamplingProfiler
+from utils.tuning import DownloadPolicy, AdaptiveDownloader, alternate_urls
+from utils.bandwidth import BandwidthManager
+from utils.reaper import Reaper
+from utils.logs import setup_logging, JobTrace, current_job, annotate
+from utils.users import UserDirectory, paginate, USERLIST_PAGE_SIZE
+from utils.batch import Batch, BatchMember, extract_links, folder_items, MAX_BATCH_SIZE, BATCH_PARALLELISM, MAX_LINK_FILE_SIZE
 
 # Load environment variables
 load_dotenv()
@@ -33,46 +54,138 @@ CHANNEL_URL = os.getenv("CHANNEL_URL", "https://t.me/Team_Sonu2")
 CONTACT_NAME = os.getenv("CONTACT_NAME", "🤙 Contact ™")
 CONTACT_URL = os.getenv("CONTACT_URL", "https://t.me/Contact_AdminSbot")
 WELCOME_URL = os.getenv("WELCOME_URL", "https://ar-hosting.pages.dev/1751519807441.jpg")
-USER_URL = os.getenv("PHOTO_URL", "https://ar-hosting.pages.dev/1751519808272.jpg")
 # ⭐ Read max size in MB default = 1900 MB
 MAX_SIZE_MB = int(os.getenv("MAX_SIZE", 1500))
 # 💥 Convert MB to bytes
 MAX_SIZE = MAX_SIZE_MB * 1024 * 1024
+# ✂️ Split files bigger than MAX_SIZE into MAX_SIZE parts instead of rejecting them
+SPLIT_LARGE_FILES = os.getenv("SPLIT_LARGE_FILES", "True").lower() == "true"
+MAX_TOTAL_SIZE = int(os.getenv("MAX_TOTAL_SIZE", 8000)) * 1024 * 1024
+SPLIT_UPLOAD_CONCURRENCY = int(os.getenv("SPLIT_UPLOAD_CONCURRENCY", 2))
 # ▶️ Video Streaming Support
 SUPPORTS_STREAMING = os.getenv("SUPPORTS_STREAMING", "True").lower() == "true"
 HAS_SPOILER = os.getenv("HAS_SPOILER", "False").lower() == "true"
+LOG_CHANNEL_ID = os.getenv("LOG_CHANNEL_ID")
+# 📥 Download backend: "aria2" (RPC daemon) or "python" (built-in segmented downloader)
+DOWNLOAD_ENGINE = os.getenv("DOWNLOAD_ENGINE", "aria2").lower()
+# 🔀 Start uploading documents while they are still downloading
+PIPELINE_UPLOADS = os.getenv("PIPELINE_UPLOADS", "False").lower() == "true"
 
 # Initialize Pyrogram client
-bot = Client("terabox_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+bot = Client(
+    "terabox_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN,
+    max_concurrent_transmissions=UPLOAD_TRANSMISSIONS
+)
 
 # Constants
 DOWNLOAD_DIR = "downloads"
+UPLOAD_PART_SIZE = 512 * 1024  # Pyrogram's upload part size
 PROGRESS_UPDATE_INTERVAL = 1  # 1 second interval for smoother progress
 
 # Regex pattern for Terabox links
 TERABOX_REGEX = r"https?://(?:www\.)?(teraboxlink\.com|terasharelink\.com|teraboxapp\.com|1024terabox\.com|terabox\.com|terasharelink\.com|terafileshare\.com|4funbox\.co|teraboxapp\.to|terabox\.app)/s/([a-zA-Z0-9_-]+)"
 
-# Setup basic logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Shared async resolver for the Terabox API
+resolver = TeraboxResolver(TERABOX_API, TERABOX_REGEX)
+# Already-uploaded files, keyed by share ID + size
+file_index = FileIndex()
+# Bounded worker pool for download/upload jobs
+scheduler = JobScheduler()
+# Weighted fair share of the DOWNLOAD_BANDWIDTH/UPLOAD_BANDWIDTH budgets
+bandwidth = BandwidthManager()
+# Single long-lived aria2c driven over RPC, capped at the whole download budget
+aria2 = Aria2Engine(global_limit=ARIA2_GLOBAL_LIMIT or bandwidth.budgets["download"])
+# Pure-Python alternative, no aria2c binary needed
+segmented = SegmentedDownloader()
+# Per-file connection/split choices, stall handling and URL fallback for both engines
+download_policy = DownloadPolicy()
+downloader = AdaptiveDownloader(download_policy, aria2, segmented)
+# Every status-message edit goes through this rate-limited editor
+progress = ProgressEditor(parse_mode=ParseMode.HTML)
+# Copies sent files to LOG_CHANNEL_ID without re-uploading them
+log_mirror = LogChannelMirror(bot, LOG_CHANNEL_ID, parse_mode=ParseMode.HTML)
+# Main bot plus optional helper sessions for uploads
+upload_pool = UploadPool(bot, build_helper_clients(API_ID, API_HASH))
+# Crash-safe record of running jobs, replayed on startup
+journal = JobJournal()
+# Free-space admission control and an optional LRU of finished downloads
+file_cache = FileCache(os.path.join(DOWNLOAD_DIR, "cache"))
+disk = DiskAdmission(DOWNLOAD_DIR, cache=file_cache)
+# Stall reporting (LOOP_BLOCK_THRESHOLD) and on-demand /profile sampling
+watchdog = BlockingDetector()
+profiler = SamplingProfiler()
+# Cached display names for /userlist
+user_directory = UserDirectory(bot)
+SHUTTING_DOWN = False
+
+# 📈 Read straight from the components on every /metrics scrape
+metrics.REGISTRY.gauge("terabox_queue_depth", "Jobs waiting for a worker", func=lambda: scheduler.queue_depth)
+metrics.REGISTRY.gauge("terabox_active_jobs", "Jobs currently running", func=lambda: scheduler.active)
+metrics.REGISTRY.gauge(
+    "terabox_flood_waits_total", "FloodWaits received", ("source",), kind="counter",
+    func=lambda: {"progress": progress.flood_waits, "log_channel": log_mirror.flood_waits})
+metrics.REGISTRY.gauge(
+    "terabox_flood_wait_seconds_total", "Seconds spent in FloodWait", ("source",), kind="counter",
+    func=lambda: {"progress": progress.flood_wait_seconds, "log_channel": log_mirror.flood_wait_seconds})
+metrics.REGISTRY.gauge(
+    "terabox_cache_hits_total", "Cache hits", ("cache",), kind="counter",
+    func=lambda: {"resolver": resolver.hits + resolver.coalesced, "file_index": file_index.hits + file_index.coalesced,
+                  "file_cache": file_cache.hits})
+metrics.REGISTRY.gauge(
+    "terabox_cache_misses_total", "Cache misses", ("cache",), kind="counter",
+    func=lambda: {"resolver": resolver.misses, "file_index": file_index.misses, "file_cache": file_cache.misses})
+metrics.REGISTRY.gauge("terabox_disk_free_bytes", "Free space in the download directory", func=disk.free)
+metrics.REGISTRY.gauge("terabox_disk_reserved_bytes", "Bytes reserved by running downloads", func=lambda: disk.reserved)
+metrics.REGISTRY.gauge(
+    "terabox_event_loop_blocks_total", "Stalls caught by the loop watchdog", kind="counter", func=lambda: watchdog.blocks)
+
+# Console plus JSON lines in a rotating bot.log, written from a background thread
+setup_logging()
 logger = logging.getLogger("terabox_bot")
 
-# Add file logging handler
-file_handler = logging.FileHandler('bot.log')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
-logger.setLevel(logging.INFO)
+# 🩺 Live job state for the web status page, keyed by status message
+job_status = {}
+# Submitted jobs that can still be cancelled: job key -> (scheduler Job, status message)
+cancellable = {}
+# Directories of running jobs, off limits for the reaper
+active_dirs = set()
 
-# Initialize Flask app
-flask_app = Flask(__name__)
+def set_status(msg, **fields):
+    entry = job_status.get(JobJournal.key(msg))
+    if entry is not None:
+        entry.update(fields, updated_at=int(time.time()))
 
-@flask_app.route('/')
-def home():
-    return render_template("index.html")
-    
-Thread(target=lambda: flask_app.run(host="0.0.0.0", port=8080), daemon=True).start()
+def active_jobs():
+    return list(job_status.values())
+
+def health():
+    lag = metrics.loop_lag_last.get()
+    healthy = bot.is_connected and not SHUTTING_DOWN and lag < 5
+    return healthy, {
+        "connected": bool(bot.is_connected),
+        "shutting_down": SHUTTING_DOWN,
+        "loop_lag": round(lag, 3),
+        "active_jobs": scheduler.active,
+        "queued_jobs": scheduler.queue_depth,
+    }
+
+async def protected_dirs():
+    # Interrupted jobs waiting to resume keep their partial downloads too
+    return active_dirs | {job["user_dir"] for job in await journal.pending() if job["user_dir"]}
+
+# 🧟 Orphaned aria2c/ffprobe processes and stale downloads/user_* directories
+reaper = Reaper(
+    DOWNLOAD_DIR,
+    # The aria2 daemon plus every ffprobe/ffmpeg a job is still waiting on (splits, remuxes)
+    protected_pids=lambda: ({aria2.process.pid} if aria2.process else set()) | media.running,
+    protected_dirs=protected_dirs, rpc_port=aria2.port
+)
+
+# Runs on the bot's event loop, started from main()
+web_server = WebServer(
+    active_jobs, health, metrics.REGISTRY.render, profile=profiler.profile,
+    root=os.path.dirname(os.path.abspath(__file__))
+)
 
 # Utility functions
 def human_readable_size(size):
@@ -87,16 +200,24 @@ def progress_bar(percentage, bar_length=20):
     empty = bar_length - filled
     return "█" * filled + "░" * empty
 
+def cancel_keyboard(message):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🛑 Cancel", callback_data=f"cancel:{message.chat.id}:{message.id}")
+    ]])
+
 async def edit_message(message, text):
-    try:
-        await message.edit_text(text, parse_mode=ParseMode.HTML)
-    except FloodWait as e:
-        await asyncio.sleep(e.value)
-        await edit_message(message, text)
-    except Exception as e:
-        logger.error(f"Error editing message: {str(e)}")
+    if isinstance(message, BatchMember):
+        # Batch files report through the batch's single message
+        message.batch.changed()
+        return
+    # Queued for the progress editor, which handles rate limits and FloodWait
+    markup = cancel_keyboard(message) if JobJournal.key(message) in cancellable else None
+    progress.push(message, text, markup)
 
 async def delete_message(message):
+    if isinstance(message, BatchMember):
+        return
+    progress.forget(message)
     try:
         await message.delete()
     except Exception as e:
@@ -116,21 +237,172 @@ def clean_directory(directory):
         logger.debug(traceback.format_exc())
         return False
 
-def parse_aria2c_output(line):
-    """Parse aria2c output to get download progress"""
+def format_eta(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+async def send_cached_file(msg, entry, caption, keyboard):
+    """Re-send an already uploaded file by its Telegram file_id"""
+    try:
+        if entry["media_type"] == "video":
+            await msg.reply_video(
+                video=entry["file_id"],
+                caption=caption,
+                parse_mode=ParseMode.HTML,
+                reply_markup=keyboard,
+                supports_streaming=SUPPORTS_STREAMING,
+                has_spoiler=HAS_SPOILER
+            )
+        else:
+            await msg.reply_document(
+                document=entry["file_id"],
+                caption=caption,
+                parse_mode=ParseMode.HTML,
+                reply_markup=keyboard
+            )
+        return True
+    except FloodWait as e:
+        await asyncio.sleep(e.value)
+        return await send_cached_file(msg, entry, caption, keyboard)
+    except Exception as e:
+        logger.warning(f"Cached file_id send failed: {str(e)}")
+        return False
+
+async def upload_split(msg, file_path, file_name, work_dir, is_video, media_info, thumb_path, keyboard, throttle=None):
+    """Upload an oversized file as MAX_SIZE parts, each sent as soon as it is ready"""
+    total = os.path.getsize(file_path)
+    readable_size = human_readable_size(total)
+    uploaded = {}
+    last_percent = -1
+    semaphore = asyncio.Semaphore(SPLIT_UPLOAD_CONCURRENCY)
+
+    async def send_part(index, part, as_video):
+        nonlocal last_percent
+        # The part generator took a slot before producing this part
+        try:
+            async def part_progress(current, _):
+                nonlocal last_percent
+                if throttle:
+                    await throttle.take(current - uploaded.get(index, 0))
+                uploaded[index] = current
+                percent = int(sum(uploaded.values()) * 100 / total)
+                if percent > last_percent:
+                    last_percent = percent
+                    await edit_message(
+                        msg,
+                        f"╭━◝━━━━━━━━━━━━◜━╮\n"
+                        f"⚡❍⊱❁ Stack Sadhu ™\n"
+                        f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+                        f"📤 <b>Uploading in parts:</b> <code>{file_name}</code>\n"
+                        f"📦 <b>Size:</b> {readable_size}\n"
+                        f"🧩 <b>Parts sent:</b> {len(sent_parts)}\n"
+                        f"🔸 {progress_bar(min(percent, 100))} 🔸\n"
+                        f"🚀 <b>Progress:</b> {min(percent, 100)}%\n"
+                        f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+                    )
+
+            caption = (
+                f"<pre>✅ Your File is Ready!</pre>\n\n"
+                f"📂 <b>File:</b> <code>{file_name}</code>\n"
+                f"🧩 <b>Part:</b> {index}\n"
+                f"📦 <b>Total Size:</b> {readable_size}"
+            )
+            if as_video:
+                info = await media.probe(part)
+                async with upload_pool.lease(os.path.getsize(part)) as uploader:
+                    sent = await upload_pool.send(
+                        uploader, msg, "video", part,
+                        caption=caption,
+                        thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
+                        parse_mode=ParseMode.HTML,
+                        reply_markup=keyboard,
+                        progress=part_progress,
+                        duration=info["duration"] or None,
+                        width=info["width"],
+                        height=info["height"],
+                        supports_streaming=SUPPORTS_STREAMING,
+                        has_spoiler=HAS_SPOILER
+                    )
+            else:
+                try:
+                    async with upload_pool.lease(part.length) as uploader:
+                        sent = await upload_pool.send(
+                            uploader, msg, "document", part,
+                            caption=caption,
+                            parse_mode=ParseMode.HTML,
+                            reply_markup=keyboard,
+                            progress=part_progress
+                        )
+                finally:
+                    part.close()
+            if not sent:
+                raise Exception(f"Part {index} upload was stopped")
+            sent_parts[index] = sent
+            return sent
+        finally:
+            # Free the part right away so disk stays around one file size
+            if as_video and os.path.exists(part):
+                os.remove(part)
+            semaphore.release()
+
+    def failed():
+        return any(task.done() and not task.cancelled() and task.exception() for task in tasks)
+
+    sent_parts = {}
+    tasks = []
     try:
-        # Example: [#1c9b1b 20MiB/100MiB(20%) CN:1 DL:3.0MiB]
-        match = re.search(r'\((\d+)%\)', line)
-        if match:
-            return int(match.group(1))
-        return None
-    except Exception:
-        return None
+        if is_video and media_info and media_info["duration"]:
+            try:
+                async for index, part in video_parts(file_path, file_name, work_dir, MAX_SIZE, semaphore):
+                    tasks.append(asyncio.create_task(send_part(index, part, True)))
+                    if failed():
+                        break
+            except RuntimeError as e:
+                if tasks:
+                    raise
+                logger.warning(f"Video split failed, falling back to byte ranges: {str(e)}")
+        if not tasks:
+            logger.info(f"✂️ Splitting {file_name} into {part_count(total, MAX_SIZE)} byte-range parts")
+            async for index, part in byte_parts(file_path, file_name, MAX_SIZE, semaphore):
+                tasks.append(asyncio.create_task(send_part(index, part, False)))
+                if failed():
+                    break
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    return [sent_parts[i] for i in sorted(sent_parts)]
         
 # Terabox processing
-async def process_terabox(user_id, terabox_url, msg):
-    USER_DIR = os.path.join(DOWNLOAD_DIR, f"user_{user_id}_{int(time.time())}")
-    os.makedirs(USER_DIR, exist_ok=True)
+async def process_terabox(user_id, terabox_url, msg, user_dir=None, item=None):
+    # A journal-resumed job reuses its old directory and partial download
+    resuming = user_dir is not None
+    if user_dir:
+        USER_DIR = user_dir
+        os.makedirs(USER_DIR, exist_ok=True)
+    else:
+        # Unique per job, a batch runs several jobs of one user at once
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        USER_DIR = tempfile.mkdtemp(prefix=f"user_{user_id}_{int(time.time())}_", dir=DOWNLOAD_DIR)
+    active_dirs.add(os.path.abspath(USER_DIR))
+    index_key = None
+    indexed_entry = None
+    download_task = None
+    probe_task = None
+    reservation = None
+    cache_key = None
+    downloaded = False
+    outcome = "failed"
+    owner = user_id == BOT_OWNER_ID
+    download_share = None
+    upload_share = None
 
     try:
         # Show processing message
@@ -143,39 +415,123 @@ async def process_terabox(user_id, terabox_url, msg):
             f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
         )
         
-        # Fetch API data
-        api_url = TERABOX_API + quote(terabox_url)
-        response = requests.get(api_url)
-        
-        if response.status_code != 200:
+        await journal.update(msg, "resolving", user_dir=USER_DIR)
+        set_status(msg, stage="resolving")
+
+        # Fetch API data (folder files arrive already resolved)
+        try:
+            if item is None:
+                with metrics.stage("resolve"):
+                    data = await resolver.resolve(terabox_url)
+            else:
+                data = item
+        except ResolverError as e:
+            logger.error(f"Resolver failed for {terabox_url}: {str(e)}")
             await edit_message(
                 msg,
                 f"❌ <b>API Error:</b> Failed to fetch link information\n"
-                f"Status Code: {response.status_code}"
+                f"Status Code: {e.status if e.status else 'N/A'}"
             )
             await asyncio.sleep(5)
             await delete_message(msg)
             return False
+
+        # 📁 Folder share: run every file in it as a batch on this message
+        items = folder_items(data, resolver.share_id(terabox_url)) if item is None else None
+        if items is not None:
+            if not items:
+                await edit_message(msg, "❌ <b>This folder has no downloadable files</b>")
+                await asyncio.sleep(5)
+                await delete_message(msg)
+                return False
+            logger.info(f"📁 {terabox_url} is a folder with {len(items)} files")
+            await start_batch(user_id, [(terabox_url, i) for i in items], msg)
+            if isinstance(msg, BatchMember):
+                msg.batch.finish(msg, "expanded")
+            outcome = "expanded"
+            return True
             
-        data = response.json()
         file_name = data["file_name"]
         download_url = data["proxy_url"]
         file_size = data["size_bytes"]
         readable_size = human_readable_size(file_size)
+        set_status(msg, file_name=file_name, size=readable_size)
+        annotate(file_name=file_name, size=file_size)
         
         # Check file size
-        if file_size > MAX_SIZE:
+        split = file_size > MAX_SIZE
+        if split and (not SPLIT_LARGE_FILES or file_size > MAX_TOTAL_SIZE):
             await edit_message(
                 msg,
                 f"❌ <b>File Too Large:</b> {readable_size}\n"
-                f"Max allowed: {human_readable_size(MAX_SIZE)}"
+                f"Max allowed: {human_readable_size(MAX_TOTAL_SIZE if SPLIT_LARGE_FILES else MAX_SIZE)}"
             )
             await asyncio.sleep(5)
             await delete_message(msg)
+            outcome = "rejected"
             return False
+
+        # Create caption and download button
+        caption = (
+            f"╭━◝━━━━━━━━━━━━◜━╮\n"
+            f"⚡❍⊱❁ Stack Sadhu ™\n"
+            f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+            f"<pre>✅ Your File is Ready!</pre>\n\n"
+            f"📂 <b>File:</b> <code>{file_name}</code>\n"
+            f"📦 <b>Size:</b> {readable_size}\n"
+            f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+        )
+        
+        # Create inline keyboard with direct download button
+        keyboard = InlineKeyboardMarkup([[  
+            InlineKeyboardButton(f"🔗 Direct Download {readable_size}", url=download_url)  
+        ]])
+
+        # ♻️ Reuse an earlier upload of the same file if we have one
+        share_id = data.get("share_key") or resolver.share_id(terabox_url)
+        while True:
+            entry = None
+            pending = file_index.inflight(share_id, file_size)
+            if pending is None:
+                entry = await file_index.get(share_id, file_size)
+                if entry is None:
+                    # Another job may have claimed the file while the index was being read
+                    index_key, pending = file_index.claim(share_id, file_size)
+            if pending is not None:
+                await edit_message(
+                    msg,
+                    f"⏳ <b>Same file is already being processed...</b>\n"
+                    f"📂 <code>{file_name}</code>"
+                )
+                entry = await file_index.wait(pending)
+                if entry is None and not pending.done():
+                    # The other job is taking too long; fetch our own copy without claiming
+                    break
+            if entry:
+                if await send_cached_file(msg, entry, caption, keyboard):
+                    logger.info(f"⚡ Served {share_id} from file index")
+                    await delete_message(msg)
+                    outcome = "cached"
+                    return True
+                await file_index.discard(share_id, file_size)
+            elif index_key:
+                break
+            # The job we waited on failed or its file_id went stale: take another turn,
+            # so a single waiter claims the file and the rest wait on it
         
         file_path = os.path.join(USER_DIR, file_name)
+        cached_path = file_cache.lookup(share_id, file_size)
+        if cached_path:
+            cache_key = (share_id, file_size)
+            file_path = cached_path
+            logger.info(f"💾 Using cached download for {share_id}")
+        is_video = file_name.lower().endswith(('.mp4', '.mkv', '.mov', '.avi', '.flv', '.webm'))
+        # Videos need a complete file for probing, so only documents are pipelined
+        watermark = ByteWatermark(file_size) if PIPELINE_UPLOADS and not is_video and not split else None
         
+        await journal.update(msg, "downloading", file_name=file_name, file_size=file_size)
+        set_status(msg, stage="downloading", percent=0)
+
         # Start download
         await edit_message(
             msg,
@@ -189,83 +545,133 @@ async def process_terabox(user_id, terabox_url, msg):
             f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
         )
         
-        # Download file with improved progress tracking
-        command = [
-            "aria2c", 
-            "-x16", 
-            "--summary-interval=1",
-            "--auto-file-renaming=false", 
-            "--allow-overwrite=true",
-            "--dir=" + USER_DIR, 
-            "--out=" + file_name, 
-            download_url
-        ]
-        
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.STDOUT
-        )
-        
-        # Track download progress with aria2c output
+        # Download file through the configured engine
         last_reported_percent = 0
-        start_time = time.time()
+        download_error = None
         timeout = 7200  # 2 hours timeout for large files
-        
-        # Pattern to match aria2c progress output
-        progress_pattern = re.compile(r'\((\d+)%\)')
-        
-        while True:
-            # Check if process is still running
-            if process.returncode is not None:
-                break
-                
-            # Check timeout
-            if time.time() - start_time > timeout:
-                process.kill()
-                await edit_message(msg, "❌ Download timed out (2 hours)")
+
+        async def download_progress(status):
+            nonlocal last_reported_percent, probe_task
+            percent = status["percent"]
+            # 🎞️ Probe the header while the rest is still downloading
+            if is_video and probe_task is None and status["head"] >= media.PROBE_HEAD_BYTES:
+                probe_task = asyncio.create_task(media.probe_head(file_path))
+            set_status(
+                msg, percent=percent, speed=f"{human_readable_size(status['speed'])}/s", eta=format_eta(status["eta"])
+            )
+            # Update progress only when it changes
+            if percent > last_reported_percent:
+                bar = progress_bar(percent)
+                try:
+                    await edit_message(
+                        msg,
+                        f"╭━◝━━━━━━━━━━━━◜━╮\n"
+                        f"⚡❍⊱❁ Stack Sadhu ™\n"
+                        f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+                        f"📥 <b>Downloading:</b> <code>{file_name}</code>\n"
+                        f"📦 <b>Size:</b> {readable_size}\n"
+                        f"🔸 {bar} 🔸\n"
+                        f"🚀 <b>Progress:</b> {percent}%\n"
+                        f"⚡ <b>Speed:</b> {human_readable_size(status['speed'])}/s | 🔗 {status['connections']}\n"
+                        f"⏳ <b>ETA:</b> {format_eta(status['eta'])}\n"
+                        f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+                    )
+                    last_reported_percent = percent
+                except Exception as e:
+                    logger.error(f"Error updating progress: {str(e)}")
+
+        # A resumed job may have finished downloading before the restart
+        already_downloaded = cached_path is not None or (
+            resuming
+            and os.path.exists(file_path)
+            and os.path.getsize(file_path) == file_size
+            and not os.path.exists(file_path + ".aria2")
+            and not os.path.exists(file_path + ".seg")
+        )
+        if already_downloaded:
+            logger.info(f"♻️ {file_path} is already on disk, skipping download")
+            watermark = None
+        else:
+            # 💽 Hold the space this job will need before writing anything
+            needed = file_size
+            if split and is_video:
+                # Parts are cut only into free upload slots, so at most this many exist at once
+                needed += min(file_size, MAX_SIZE * (SPLIT_UPLOAD_CONCURRENCY + 1))
+            elif is_video and media.FASTSTART:
+                # Room for a faststart remux copy
+                needed += file_size
+
+            async def on_disk_wait():
+                await edit_message(
+                    msg,
+                    f"╭━◝━━━━━━━━━━━━◜━╮\n"
+                    f"⚡❍⊱❁ Stack Sadhu ™\n"
+                    f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+                    f"💽 <b>Waiting for disk space...</b>\n"
+                    f"📂 <code>{file_name}</code> ({readable_size})\n"
+                    f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+                )
+
+            try:
+                reservation = await disk.reserve(needed, USER_DIR, on_wait=on_disk_wait)
+            except DiskFullError as e:
+                logger.error(f"Disk admission refused {file_name}: {str(e)}")
+                await edit_message(msg, f"❌ <b>Not enough disk space</b> for {readable_size}")
                 await asyncio.sleep(5)
                 await delete_message(msg)
                 return False
-                
-            # Read stdout line by line
-            line = await process.stdout.readline()
-            if not line:
-                await asyncio.sleep(0.1)
-                continue
-                
-            line = line.decode().strip()
-            percent_match = progress_pattern.search(line)
-            
-            if percent_match:
-                percent = int(percent_match.group(1))
-                # Update progress only when it changes
-                if percent > last_reported_percent:
-                    bar = progress_bar(percent)
-                    
-                    try:
-                        await edit_message(
-                            msg,
-                            f"╭━◝━━━━━━━━━━━━◜━╮\n"
-                            f"⚡❍⊱❁ Stack Sadhu ™\n"
-                            f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
-                            f"📥 <b>Downloading:</b> <code>{file_name}</code>\n"
-                            f"📦 <b>Size:</b> {readable_size}\n"
-                            f"🔸 {bar} 🔸\n"
-                            f"🚀 <b>Progress:</b> {percent}%\n"
-                            f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
-                        )
-                        last_reported_percent = percent
-                    except Exception as e:
-                        logger.error(f"Error updating progress: {str(e)}")
-            
-            await asyncio.sleep(0.1)
-        
-        # Wait for process to finish
-        await process.wait()
+
+        if not already_downloaded:
+            download_share = bandwidth.join("download", file_size, owner)
+        download_started = time.monotonic()
+        if watermark:
+            # Upload follows the download; wait only for the file to be preallocated
+            download_task = asyncio.create_task(segmented.download(
+                download_url, file_path, file_size, interval=PROGRESS_UPDATE_INTERVAL,
+                timeout=timeout, watermark=watermark, throttle=download_share
+            ))
+            metrics.active_downloads.inc(engine="python")
+            download_task.add_done_callback(lambda _: metrics.active_downloads.dec(engine="python"))
+            try:
+                file_size = await watermark.ready()
+            except SegmentedDownloadError as e:
+                logger.warning(f"Pipelined upload unavailable, downloading first: {str(e)}")
+                await asyncio.gather(download_task, return_exceptions=True)
+                download_task = None
+                watermark = None
+
+        engine = "python" if DOWNLOAD_ENGINE == "python" else "aria2"
+        annotate(engine="pipelined" if watermark else "none" if already_downloaded else engine)
+        if not already_downloaded and not watermark:
+            metrics.active_downloads.inc(engine=engine)
+        try:
+            if already_downloaded or watermark:
+                # Nothing to fetch here: done before the restart, or streaming alongside the upload
+                pass
+            else:
+                await downloader.download(
+                    alternate_urls(data), USER_DIR, file_name, file_size, engine=engine,
+                    on_progress=download_progress, interval=PROGRESS_UPDATE_INTERVAL, timeout=timeout,
+                    throttle=download_share
+                )
+        except asyncio.TimeoutError:
+            await edit_message(msg, "❌ Download timed out (2 hours)")
+            await asyncio.sleep(5)
+            await delete_message(msg)
+            return False
+        except (Aria2Error, SegmentedDownloadError) as e:
+            logger.error(f"{DOWNLOAD_ENGINE} download failed: {str(e)}")
+            download_error = str(e)
+        finally:
+            if not already_downloaded and not watermark:
+                metrics.active_downloads.dec(engine=engine)
         
-        # Verify download
-        if not os.path.exists(file_path) or os.path.getsize(file_path) < file_size * 0.95:  # 95% tolerance
+        # Verify download (pipelined files are preallocated and checked after upload; cached
+        # copies were checked before they were stored and may since have been remuxed)
+        if download_error or not os.path.exists(file_path) or (
+            not cached_path and os.path.getsize(file_path) < file_size * 0.95  # 95% tolerance
+        ):
+            metrics.stage_failures.inc(stage="download")
             await edit_message(
                 msg,
                 f"❌ <b>Download Failed:</b>\n"
@@ -276,7 +682,17 @@ async def process_terabox(user_id, terabox_url, msg):
             await asyncio.sleep(5)
             await delete_message(msg)
             return False
-        
+        downloaded = not watermark and not cached_path
+        if not watermark:
+            bandwidth.leave(download_share)
+            download_share = None
+        if downloaded:
+            download_seconds = time.monotonic() - download_started
+            metrics.observe_stage("download", download_seconds)
+            metrics.record_transfer("download", file_size, download_seconds)
+
+        await journal.update(msg, "uploading")
+        set_status(msg, stage="uploading", percent=0, speed="", eta="")
 
         # Prepare for upload
         await edit_message(
@@ -291,44 +707,75 @@ async def process_terabox(user_id, terabox_url, msg):
             f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
         )
         
-        # Create caption and download button
-        caption = (
-            f"╭━◝━━━━━━━━━━━━◜━╮\n"
-            f"⚡❍⊱❁ Stack Sadhu ™\n"
-            f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
-            f"<pre>✅ Your File is Ready!</pre>\n\n"
-            f"📂 <b>File:</b> <code>{file_name}</code>\n"
-            f"📦 <b>Size:</b> {readable_size}\n"
-            f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
-        )
-        
-        # Create inline keyboard with direct download button
-        keyboard = InlineKeyboardMarkup([[  
-            InlineKeyboardButton(f"🔗 Direct Download {readable_size}", url=download_url)  
-        ]])
-        
         # Send file with upload progress
-        is_video = file_name.lower().endswith(('.mp4', '.mkv', '.mov', '.avi', '.flv', '.webm'))
         thumb_path = os.path.join(USER_DIR, "thumb.jpg")
+        media_info = None
         
         if "thumbnail" in data:
             try:
-                thumb_data = requests.get(data["thumbnail"]).content
+                thumb_data = await resolver.fetch_bytes(data["thumbnail"])
                 with open(thumb_path, "wb") as f:
                     f.write(thumb_data)
             except Exception as e:
                 logger.warning(f"Thumbnail download failed: {str(e)}")
                 thumb_path = None
+
+        if is_video:
+            if probe_task:
+                try:
+                    media_info = await probe_task
+                except Exception as e:
+                    logger.warning(f"Early probe failed: {str(e)}")
+            if not media_info:
+                with metrics.stage("probe"):
+                    media_info = await media.probe(file_path)
+            # 🎬 Split parts are already cut as faststart files; cached files were remuxed when stored
+            reason = None
+            if media.FASTSTART and not split and not cached_path:
+                reason = await media.remux_reason(file_path, media_info)
+            if reason:
+                await edit_message(
+                    msg,
+                    f"╭━◝━━━━━━━━━━━━◜━╮\n"
+                    f"⚡❍⊱❁ Stack Sadhu ™\n"
+                    f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+                    f"🎬 <b>Optimizing for streaming:</b> <code>{file_name}</code>\n"
+                    f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+                )
+                with metrics.stage("remux"):
+                    file_path = await media.faststart(file_path, media_info, reason)
+            if not thumb_path or not os.path.exists(thumb_path):
+                # No remote thumbnail, grab a frame locally
+                thumb_path = await media.generate_thumbnail(
+                    file_path, os.path.join(USER_DIR, "thumb.jpg"), media_info["duration"]
+                )
         
         # Upload progress callback
         last_upload_percent = 0
+        last_upload_bytes = 0
         
         async def progress_callback(current, total):
-            nonlocal last_upload_percent
+            nonlocal last_upload_percent, last_upload_bytes
+            # ⚖️ Pace parts to this job's share of the upload budget
+            await upload_share.take(current - last_upload_bytes)
+            last_upload_bytes = current
+            if watermark:
+                # Hold Pyrogram back until the next part has landed on disk
+                try:
+                    await watermark.wait_for(current + UPLOAD_PART_SIZE)
+                except Exception as e:
+                    logger.error(f"Pipelined download failed mid-upload: {str(e)}")
+                    raise StopTransmission()
             percent = int(current * 100 / total)
+            elapsed = time.monotonic() - upload_started
+            speed = current / elapsed if elapsed > 0 else 0
+            set_status(
+                msg, percent=percent, speed=f"{human_readable_size(speed)}/s",
+                eta=format_eta((total - current) / speed if speed else None)
+            )
             
-            # Update every 5% or when it changes significantly
-            if percent > last_upload_percent + 5 or percent == 100:
+            # Update whenever it changes, the editor drops stale states
+            if percent > last_upload_percent:
                 bar = progress_bar(percent)
                 try:
                     await edit_message(
@@ -340,75 +787,109 @@ async def process_terabox(user_id, terabox_url, msg):
                         f"📦 <b>Size:</b> {readable_size}\n"
                         f"🔸 {bar} 🔸\n"
                         f"🚀 <b>Progress:</b> {percent}%\n"
-                        f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+                        + (f"📥 <b>Downloaded:</b> {int(watermark.available * 100 / total)}%\n" if watermark else "")
+                        + f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
                     )
                     last_upload_percent = percent
                 except Exception as e:
                     logger.error(f"Error updating upload progress: {str(e)}")
         
+        upload_share = bandwidth.join("upload", file_size, owner)
+        upload_started = time.monotonic()
         try:
             # Calculate upload timeout based on file size
             upload_timeout = max(600, int(file_size / (50 * 1024 * 1024)) * 60 + 600)  # More generous timeout
+            if watermark:
+                # The upload also waits on the download
+                upload_timeout += timeout
+                await watermark.wait_for(UPLOAD_PART_SIZE)
+
+            if split:
+                parts = await asyncio.wait_for(
+                    upload_split(
+                        msg, file_path, file_name, USER_DIR, is_video, media_info, thumb_path, keyboard,
+                        throttle=upload_share
+                    ),
+                    timeout=upload_timeout
+                )
+                for index, part in enumerate(parts, start=1):
+                    part_media = part.video or part.document
+                    log_mirror.post(
+                        part_media.file_id,
+                        f"📂 <b>File:</b> <code>{file_name}</code> (part {index}/{len(parts)})\n📦 <b>Size:</b> {readable_size}"
+                    )
+                metrics.observe_stage("upload", time.monotonic() - upload_started)
+                metrics.record_transfer("upload", file_size, time.monotonic() - upload_started)
+                await delete_message(msg)
+                outcome = "success"
+                return True
             
+            upload_kwargs = dict(
+                caption=caption,
+                thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
+                parse_mode=ParseMode.HTML,
+                progress=progress_callback
+            )
             if is_video:
-                duration = get_video_duration(file_path)
+                duration = media_info["duration"]
                 if duration == 0:
                     logger.warning("⚠️ ffprobe failed to detect duration, setting to None")
                     duration = None
-                
-                # Use asyncio.wait_for for timeout handling
-                await asyncio.wait_for(
-                    msg.reply_video(
-                        video=file_path,
-                        caption=caption,
-                        thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
-                        parse_mode=ParseMode.HTML,
-                        reply_markup=keyboard,
-                        progress=progress_callback,
-                        duration=duration,
-                        supports_streaming=SUPPORTS_STREAMING,
-                        has_spoiler=HAS_SPOILER
-                    ),
-                    timeout=upload_timeout
+                upload_kwargs.update(
+                    duration=duration,
+                    width=media_info["width"],
+                    height=media_info["height"],
+                    supports_streaming=SUPPORTS_STREAMING,
+                    has_spoiler=HAS_SPOILER
                 )
-            else:
+
+            # Least-loaded session uploads, the main bot delivers
+            async with upload_pool.lease(file_size) as uploader:
                 # Use asyncio.wait_for for timeout handling
-                await asyncio.wait_for(
-                    msg.reply_document(
-                        document=file_path,
-                        caption=caption,
-                        thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None,
-                        parse_mode=ParseMode.HTML,
-                        reply_markup=keyboard,
-                        progress=progress_callback
+                sent = await asyncio.wait_for(
+                    upload_pool.send(
+                        uploader, msg, "video" if is_video else "document", file_path,
+                        reply_markup=keyboard, **upload_kwargs
                     ),
                     timeout=upload_timeout
                 )
-            
-            # Send a copy of the file to the log channel
-            log_channel_id = os.getenv("LOG_CHANNEL_ID")
-            if log_channel_id:
+
+            upload_seconds = time.monotonic() - upload_started
+            metrics.observe_stage("upload", upload_seconds)
+            metrics.record_transfer("upload", file_size, upload_seconds)
+
+            if download_task:
+                # Make sure every byte we streamed was really downloaded
+                await download_task
+                if not sent:
+                    raise Exception("Upload stopped before the download finished")
+                downloaded = True
+                # Pipelined: the download ran alongside the upload
+                metrics.observe_stage("download", time.monotonic() - download_started)
+                metrics.record_transfer("download", file_size, time.monotonic() - download_started)
+
+            # 📇 Remember the file_id so repeat requests skip download + upload
+            sent_media = sent.video or sent.document if sent else None
+            if sent_media:
+                indexed_entry = {
+                    "file_id": sent_media.file_id,
+                    "media_type": "video" if sent.video else "document",
+                    "file_name": file_name
+                }
                 try:
-                    if is_video:
-                        await bot.send_video(
-                            chat_id=log_channel_id,
-                            video=file_path,
-                            caption=f"📂 <b>File:</b> <code>{file_name}</code>\n📦 <b>Size:</b> {readable_size}",
-                            parse_mode=ParseMode.HTML,
-                            duration=duration,  # Ensure duration is passed
-                            thumb=thumb_path if thumb_path and os.path.exists(thumb_path) else None  # Ensure thumbnail is passed
-                        )
-                    else:
-                        await bot.send_document(
-                            chat_id=log_channel_id,
-                            document=file_path,
-                            caption=f"📂 <b>File:</b> <code>{file_name}</code>\n📦 <b>Size:</b> {readable_size}",
-                            parse_mode=ParseMode.HTML
-                        )
+                    await file_index.put(share_id, file_size, sent_media.file_id, indexed_entry["media_type"], file_name)
                 except Exception as e:
-                    logger.error(f"Failed to send file to log channel: {str(e)}")
+                    logger.error(f"Failed to index file_id: {str(e)}")
+            
+            # Mirror to the log channel by file_id, in the background
+            if indexed_entry:
+                log_mirror.post(
+                    indexed_entry["file_id"],
+                    f"📂 <b>File:</b> <code>{file_name}</code>\n📦 <b>Size:</b> {readable_size}"
+                )
         
         except asyncio.TimeoutError:
+            metrics.stage_failures.inc(stage="upload")
             logger.error(f"Upload timed out after {upload_timeout} seconds")
             await edit_message(
                 msg,
@@ -420,6 +901,7 @@ async def process_terabox(user_id, terabox_url, msg):
             await delete_message(msg)
             return False
         except Exception as e:
+            metrics.stage_failures.inc(stage="upload")
             logger.error(f"Upload failed: {str(e)}")
             await edit_message(
                 msg,
@@ -432,8 +914,15 @@ async def process_terabox(user_id, terabox_url, msg):
         
         # Delete progress message after successful upload
         await delete_message(msg)
+        outcome = "success"
         return True
-        
+
+    except asyncio.CancelledError:
+        if not SHUTTING_DOWN:
+            outcome = "cancelled"
+            logger.info(f"🛑 Job {JobJournal.key(msg)} cancelled during {job_status.get(JobJournal.key(msg), {}).get('stage')}")
+            asyncio.create_task(show_cancelled(msg))
+        raise
     except Exception as e:
         logger.error(f"Processing error: {str(e)}")
         await edit_message(
@@ -445,10 +934,46 @@ async def process_terabox(user_id, terabox_url, msg):
         await delete_message(msg)
         return False
     finally:
-        if clean_directory(USER_DIR):
-            logger.info(f"🧹 Cleaned: {USER_DIR}")
+        job_status.pop(JobJournal.key(msg), None)
+        active_dirs.discard(os.path.abspath(USER_DIR))
+        bandwidth.leave(download_share)
+        bandwidth.leave(upload_share)
+        outcome = "interrupted" if SHUTTING_DOWN and outcome == "failed" else outcome
+        metrics.jobs_total.inc(outcome=outcome)
+        trace = current_job.get()
+        if trace:
+            trace.summary(outcome)
+        if probe_task and not probe_task.done():
+            probe_task.cancel()
+        if download_task and not download_task.done():
+            download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
+        if index_key:
+            file_index.release(index_key, indexed_entry)
+        if reservation:
+            reservation.release()
+        if cache_key:
+            await file_cache.unpin(*cache_key)
+        elif downloaded and not SHUTTING_DOWN:
+            # Keep it around in case the user retries or someone asks again
+            try:
+                await file_cache.store(share_id, file_size, file_path)
+            except OSError as e:
+                logger.warning(f"Couldn't cache {file_path}: {str(e)}")
+        # Batch files aren't journaled (a folder file can't be rebuilt from its URL), so
+        # nothing would resume them: their partial files go even when shutting down
+        if SHUTTING_DOWN and not isinstance(msg, BatchMember):
+            # Keep partial files and the journal entry for the next start
+            logger.info(f"Shutting down, keeping {USER_DIR} for resume")
         else:
-            logger.warning(f"⚠️ Cleanup failed: {USER_DIR}")
+            try:
+                await journal.remove(msg)
+            except Exception as e:
+                logger.error(f"Failed to clear journal entry: {str(e)}")
+            if clean_directory(USER_DIR):
+                logger.info(f"🧹 Cleaned: {USER_DIR}")
+            else:
+                logger.warning(f"⚠️ Cleanup failed: {USER_DIR}")
         
         
 
@@ -501,10 +1026,54 @@ async def callback_query_handler(client, callback_query):
                 "⚡❍⊱❁ Stack Sadhu  ™",
                 show_alert=True
             )
+        elif callback_query.data.startswith("cancel:"):
+            user_id = callback_query.from_user.id
+            entries = find_jobs(callback_query.data.split(":", 1)[1])
+            if not entries:
+                return await callback_query.answer("ℹ️ This job has already finished.")
+            if user_id != BOT_OWNER_ID and any(job.user_id != user_id for _, job, _ in entries):
+                return await callback_query.answer("🚫 This isn't your job.")
+            count = await cancel_jobs(entries)
+            await callback_query.answer(f"🛑 Cancelled {count} job(s)." if count else "ℹ️ Already finishing.")
+        elif callback_query.data.startswith("userlist:"):
+            if callback_query.from_user.id != BOT_OWNER_ID:
+                return await callback_query.answer("🚫 You cannot run this command.")
+            page = callback_query.data.split(":", 1)[1]
+            if page.isdigit():
+                text, keyboard = await render_userlist(int(page))
+                await callback_query.message.edit_text(
+                    text, parse_mode=ParseMode.HTML, reply_markup=keyboard, disable_web_page_preview=True
+                )
+            await callback_query.answer()
     except FloodWait as e:
         await asyncio.sleep(e.value)
         await callback_query_handler(client, callback_query)
 
+def parse_user_args(message):
+    """User IDs plus ``days=N`` / ``quota=N`` options from a command and the message it replies to
+
+    IDs may be separated by spaces, commas or newlines, so a pasted list works.
+    """
+    text = " ".join(message.text.split()[1:])
+    if message.reply_to_message and message.reply_to_message.text:
+        text += " " + message.reply_to_message.text
+    ids, options, bad = [], {}, []
+    for token in re.split(r"[\s,]+", text):
+        if not token:
+            continue
+        if "=" in token:
+            name, _, value = token.partition("=")
+            if name in ("days", "quota") and value.isdigit():
+                options[name] = int(value)
+            else:
+                bad.append(token)
+        elif token.lstrip("-").isdigit():
+            if int(token) not in ids:
+                ids.append(int(token))
+        else:
+            bad.append(token)
+    return ids, options, bad
+
 # ✅ Add user command
 @bot.on_message(filters.command("adduser"))
 async def add_user_cmd(client, message):
@@ -513,30 +1082,40 @@ async def add_user_cmd(client, message):
 
     try:
         logger.info("Adduser command triggered")
-        args = message.text.split()
-
-        if len(args) < 2:
-            return await message.reply("❌ Use: /adduser <user_id>")
-
-        try:
-            new_id = int(args[1])
-        except ValueError:
-            return await message.reply("❌ Invalid user ID! Enter a number.")
-
-        result = add_authorized_user(new_id)
+        ids, options, bad = parse_user_args(message)
 
-        if result:
-            await message.reply(f"✅ User `{new_id}` Added!")
+        if bad:
+            return await message.reply(f"❌ Invalid user ID or option: `{bad[0]}`")
+        if not ids:
+            return await message.reply("❌ Use: /adduser <user_id> [user_id...] [days=N] [quota=N]")
 
-            # ✅ Notify user
-            try:
-                await client.send_message(new_id, "✅ You've been added to the authorized user list.")
-                logger.info(f"Notified user {new_id}")
-            except Exception as e:
-                logger.warning(f"Couldn't message user {new_id}: {e}")
+        expires = time.time() + options["days"] * 86400 if "days" in options else None
+        added = auth_store.add(ids, expires=expires, quota=options.get("quota"))
+        limits = ""
+        if "days" in options:
+            limits += f" for {options['days']} days"
+        if "quota" in options:
+            limits += f", {options['quota']} files/day"
 
+        if len(ids) == 1:
+            if added:
+                await message.reply(f"✅ User `{ids[0]}` Added{limits}!")
+            else:
+                await message.reply(f"ℹ️ User `{ids[0]}` was already added{', limits updated' if limits else ''}.")
         else:
-            await message.reply(f"ℹ️ User `{new_id}` was already added.")
+            await message.reply(
+                f"✅ Added {len(added)} of {len(ids)} users{limits}"
+                f" ({len(ids) - len(added)} already authorized). Total: {len(auth_store)}"
+            )
+
+        # ✅ Notify users, only for small lists to stay clear of flood limits
+        if len(added) <= 5:
+            for new_id in added:
+                try:
+                    await client.send_message(new_id, "✅ You've been added to the authorized user list.")
+                    logger.info(f"Notified user {new_id}")
+                except Exception as e:
+                    logger.warning(f"Couldn't message user {new_id}: {e}")
     except Exception as e:
         logger.exception("Error in adduser")
         await message.reply(f"❌ Error: {str(e)}")
@@ -549,26 +1128,64 @@ async def remove_user_cmd(client, message):
 
     try:
         logger.info("Removeuser command triggered")
-        args = message.text.split()
+        ids, options, bad = parse_user_args(message)
 
-        if len(args) < 2:
-            return await message.reply("❌ Use: /removeuser <user_id>")
+        if bad or options:
+            return await message.reply(f"❌ Invalid user ID: `{(bad or list(options))[0]}`")
+        if not ids:
+            return await message.reply("❌ Use: /removeuser <user_id> [user_id...]")
 
-        try:
-            uid = int(args[1])
-        except ValueError:
-            return await message.reply("❌ Invalid user ID! Enter a number.")
+        removed = auth_store.remove(ids)
 
-        result = remove_authorized_user(uid)
-
-        if result:
-            await message.reply(f"❎ User `{uid}` removed!")
+        if len(ids) == 1:
+            if removed:
+                await message.reply(f"❎ User `{ids[0]}` removed!")
+            else:
+                await message.reply(f"⚠️ User `{ids[0]}` was not authorized.")
         else:
-            await message.reply(f"⚠️ User `{uid}` was not authorized.")
+            await message.reply(
+                f"❎ Removed {len(removed)} of {len(ids)} users"
+                f" ({len(ids) - len(removed)} weren't authorized). Total: {len(auth_store)}"
+            )
     except Exception as e:
         logger.exception("Error in removeuser")
         await message.reply(f"❌ Error: {str(e)}")
 
+async def render_userlist(page):
+    """Text and inline keyboard for one page of the authorized user list"""
+    everyone = get_authorized_users()
+    users, page, pages = paginate(everyone, page)
+    names = await user_directory.names(users)
+
+    text = f"👤 <b>Authorized User List</b> ({len(auth_store)} users)\n"
+    text += "═══════════════════════\n"
+    for i, uid in enumerate(users, start=page * USERLIST_PAGE_SIZE + 1):
+        name = html.escape(names.get(uid) or "Name not found (❗Hasn't started the bot)")
+        text += f"🔹 {i}. {name}\n🆔 <code>{uid}</code>"
+        details = auth_store.details(uid)
+        if details.get("expires"):
+            text += f" | ⌛ {time.strftime('%Y-%m-%d', time.localtime(details['expires']))}"
+        if details.get("quota"):
+            text += f" | 📉 {details['quota']} files/day"
+        text += "\n\n"
+    text += "═══════════════════════"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"userlist:{page - 1}"))
+    nav.append(InlineKeyboardButton(f"📄 {page + 1}/{pages}", callback_data="userlist:current"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"userlist:{page + 1}"))
+    keyboard = InlineKeyboardMarkup([
+        nav,
+        [InlineKeyboardButton("💧 Contact 💦", url="https://t.me/Contact_AdminSbot")]
+    ])
+    if page < pages - 1:
+        # Warm the cache so the Next button answers without a round-trip
+        upcoming, _, _ = paginate(everyone, page + 1)
+        asyncio.create_task(user_directory.names(upcoming))
+    return text, keyboard
+
 # ✅ Userlist command
 @bot.on_message(filters.command("userlist"))
 async def list_users(client, message):
@@ -579,49 +1196,19 @@ async def list_users(client, message):
     logger.info(f"/userlist command triggered by: {message.from_user.id}")
 
     try:
-        users = get_authorized_users()
-        logger.info(f"AUTHORIZED_USERS inside /userlist: {users}")
-
-        if not users:
+        if not len(auth_store):
             logger.warning("User list is empty!")
             return await message.reply("⚠️ There are no authorized users.")
 
-        # ✅ Plain text formatting
-        text = "👤 **Authorized User List:**\n"
-        text += "═══════════════════════\n"
-
-        for i, uid in enumerate(users, start=1):
-            try:
-                user = await client.get_users(uid)
-                name = user.first_name or "No name"
-                logger.info(f"User #{i}: {name} ({uid})")
-                text += f"🔹 {i}. {name}\n🆔 {uid}\n\n"
-            except Exception as e:
-                name = "Name not found (❗Hasn't started the bot)"
-                logger.warning(f"User ID {uid} fetch failed: {str(e)}")
-                text += f"🔹 {i}. {name}\n🆔 {uid}\n\n"
-
-        text += "═══════════════════════"
-
-        # ✅ Inline button
-        developer = InlineKeyboardMarkup([
-            [InlineKeyboardButton("💧 Contact 💦", url="https://t.me/Contact_AdminSbot")]
-        ])
-
-        # ✅ Try sending with image
-        try:
-            await message.reply_photo(
-                photo=USER_URL,
-                caption=text,
-                reply_markup=developer
-            )
-        except Exception as e:
-            logger.warning(f"Couldn't send photo: {e}")
-            await message.reply(
-                text=text,
-                reply_markup=developer,
-                disable_web_page_preview=True
-            )
+        args = message.text.split()
+        page = int(args[1]) - 1 if len(args) > 1 and args[1].isdigit() else 0
+        text, keyboard = await render_userlist(page)
+        await message.reply(
+            text=text,
+            parse_mode=ParseMode.HTML,
+            reply_markup=keyboard,
+            disable_web_page_preview=True
+        )
 
         logger.info("/userlist executed successfully.")
 
@@ -629,6 +1216,147 @@ async def list_users(client, message):
         logger.exception(f"❌ Error in /userlist command: {str(e)}")
         await message.reply(f"❌ Error: {str(e)}")
 
+# ✅ Stats command
+@bot.on_message(filters.command("stats"))
+async def stats_cmd(client, message):
+    if message.from_user.id != BOT_OWNER_ID:
+        return await message.reply("🚫 You cannot run this command.")
+
+    stats = resolver.stats()
+    jobs = scheduler.stats()
+    edits = progress.stats()
+    mirror = log_mirror.stats()
+    uploaders = upload_pool.stats()
+    cache = file_cache.stats()
+    reaped = reaper.stats()
+    text = (
+        "📊 <b>Resolver Stats</b>\n"
+        f"✅ Hits: {stats['hits']} | 🔁 Coalesced: {stats['coalesced']} | ❌ Misses: {stats['misses']}\n"
+        f"📈 Hit rate: {stats['hit_rate'] * 100:.1f}%\n"
+        f"🌐 API requests: {stats['requests']} | ⚠️ Errors: {stats['errors']}\n"
+        f"⏱ Avg latency: {stats['latency_avg']:.2f}s | Last: {stats['latency_last']:.2f}s\n"
+        f"💾 Saved: ~{stats['saved_seconds']:.1f}s | Cached links: {stats['cached']}\n\n"
+        "🧵 <b>Job Queue</b>\n"
+        f"⚙️ Active: {jobs['active']}/{jobs['workers']} | ⏳ Queued: {jobs['queued']}\n"
+        f"✅ Done: {jobs['completed']} | ❌ Failed: {jobs['failed']} | 🚦 Rejected: {jobs['rejected']}"
+        f" | 🛑 Cancelled: {jobs['cancelled']}\n\n"
+        "✏️ <b>Progress Edits</b>\n"
+        f"📝 Sent: {edits['edits']} | ⏭ Skipped: {edits['superseded'] + edits['duplicates']} | ⏳ Pending: {edits['pending']}\n"
+        f"🌊 FloodWaits: {edits['flood_waits']} ({edits['flood_wait_seconds']}s)\n\n"
+        "🗂 <b>Log Channel</b>\n"
+        f"📤 Posted: {mirror['posted']} | ⏳ Queued: {mirror['queued']} | ❌ Failed: {mirror['failed'] + mirror['dropped']}\n"
+        f"🌊 FloodWaits: {mirror['flood_waits']} ({mirror['flood_wait_seconds']}s)\n\n"
+        "📤 <b>Upload Sessions</b>\n"
+        + "\n".join(
+            f"• {u['name']}: {u['active']} active | {u['uploads']} done | {human_readable_size(u['bytes'])}"
+            for u in uploaders
+        )
+        + "\n\n💽 <b>Disk</b>\n"
+        f"🆓 Free: {human_readable_size(disk.free())} | 🔒 Reserved: {human_readable_size(disk.reserved)}\n"
+        f"⏳ Waits: {disk.waits} ({disk.wait_seconds:.0f}s)\n"
+        f"💾 Cache: {cache['files']} files, {human_readable_size(cache['bytes'])} | ✅ {cache['hits']} hits\n"
+        f"🧟 Reaped: {reaped['killed']} processes, {reaped['removed']} dirs ({human_readable_size(reaped['freed'])})"
+    )
+    budgets = bandwidth.stats()
+    if any(b["budget"] for b in budgets.values()):
+        text += "\n\n⚖️ <b>Bandwidth</b>\n" + "\n".join(
+            f"• {direction}: {human_readable_size(b['budget'])}/s over {b['jobs']} jobs"
+            for direction, b in budgets.items() if b["budget"]
+        )
+    hosts = download_policy.stats()
+    if hosts:
+        text += "\n\n🎛️ <b>Download Hosts</b>\n" + "\n".join(
+            f"• {name}: {h['active']} active | {human_readable_size(h['per_connection'])}/s per conn"
+            f" | 🐌 {h['stalls']} stalls | ❌ {h['failures']} failed"
+            for name, h in hosts.items()
+        )
+    if watchdog.enabled:
+        blocks = watchdog.stats()
+        text += (
+            "\n\n🐢 <b>Loop Watchdog</b>\n"
+            f"⛔ Stalls: {blocks['blocks']} ({blocks['blocked_seconds']}s) | Longest: {blocks['longest']}s"
+        )
+    await message.reply(text, parse_mode=ParseMode.HTML)
+
+# 🔬 Profile command: sample the running bot and send back a flamegraph file
+@bot.on_message(filters.command("profile"))
+async def profile_cmd(client, message):
+    if message.from_user.id != BOT_OWNER_ID:
+        return await message.reply("🚫 You cannot run this command.")
+
+    args = message.text.split()
+    seconds = int(args[1]) if len(args) > 1 and args[1].isdigit() else 15
+    status = await message.reply(f"🔬 Sampling for {seconds}s...")
+    try:
+        path, samples = await profiler.profile(seconds)
+    except RuntimeError as e:
+        return await status.edit_text(f"⚠️ {str(e)}")
+    await message.reply_document(
+        path, caption=f"🔥 {samples} samples, collapsed stacks for flamegraph.pl / speedscope"
+    )
+    await status.delete()
+
+QUOTA_REACHED = "📉 You've reached your daily file quota, please try again tomorrow."
+
+# 🛑 Cancel command: reply to a status message for one job, otherwise every job of yours
+@bot.on_message(filters.command("cancel"))
+async def cancel_cmd(client, message):
+    user_id = message.from_user.id
+    args = message.text.split()
+    reply = message.reply_to_message
+    if reply:
+        entries = find_jobs(f"{reply.chat.id}:{reply.id}", None if user_id == BOT_OWNER_ID else user_id)
+    elif len(args) > 1 and args[1] == "all" and user_id == BOT_OWNER_ID:
+        entries = find_jobs()
+    else:
+        entries = find_jobs(user_id=user_id)
+    if not entries:
+        return await message.reply("ℹ️ No running or queued jobs to cancel.")
+    count = await cancel_jobs(entries)
+    await message.reply(f"🛑 Cancelled {count} job(s).")
+
+async def reply_batch(user_id, links, message):
+    """Start one batch for several links with a single status message"""
+    left = auth_store.remaining(user_id)
+    if left == 0:
+        await message.reply(QUOTA_REACHED)
+        return
+    note = ""
+    if left is not None and left < len(links):
+        note = f"\n📉 Only the first {left} fit in today's quota"
+        links = links[:left]
+    try:
+        msg = await message.reply(
+            f"📦 <b>Batch of {len(links)} links received...</b>{note}",
+            parse_mode=ParseMode.HTML
+        )
+    except FloodWait as e:
+        await asyncio.sleep(e.value)
+        return await reply_batch(user_id, links, message)
+    auth_store.charge(user_id, len(links))
+    await start_batch(user_id, [(link, None) for link in links], msg)
+
+# 📄 Link lists: a .txt file with one or more Terabox links
+@bot.on_message(filters.private & filters.document)
+async def link_file_handler(client: Client, message: Message):
+    user_id = message.from_user.id
+    document = message.document
+    if not (document.file_name or "").lower().endswith(".txt"):
+        return
+    if not is_authorized(user_id):
+        await message.reply("🚫 You are not authorized to use this bot.")
+        return
+    if document.file_size > MAX_LINK_FILE_SIZE:
+        await message.reply(f"❌ Link list too large (max {human_readable_size(MAX_LINK_FILE_SIZE)})")
+        return
+
+    data = await message.download(in_memory=True)
+    links = extract_links(bytes(data.getbuffer()).decode("utf-8", "ignore"), TERABOX_REGEX)
+    if not links:
+        await message.reply("❌ No Terabox links found in this file")
+        return
+    await reply_batch(user_id, links, message)
+
 # Message handler
 @bot.on_message(filters.private & filters.text)
 async def message_handler(client: Client, message: Message):
@@ -639,7 +1367,12 @@ async def message_handler(client: Client, message: Message):
         await message.reply("🚫 You are not authorized to use this bot.")
         return
 
-    if not re.match(TERABOX_REGEX, text):
+    links = extract_links(text, TERABOX_REGEX)
+    if len(links) > 1:
+        await reply_batch(user_id, links, message)
+        return
+
+    if not links:
         try:
             error_msg = await message.reply("❌ Please send a valid Terabox link")
             await asyncio.sleep(10)
@@ -648,6 +1381,10 @@ async def message_handler(client: Client, message: Message):
             pass
         return
 
+    if auth_store.remaining(user_id) == 0:
+        await message.reply(QUOTA_REACHED)
+        return
+
     try:
         msg = await message.reply(
             f"╭━◝━━━━━━━━━━━━◜━╮\n"
@@ -670,7 +1407,233 @@ async def message_handler(client: Client, message: Message):
         return
 
     # Proceed only if no FloodWait
-    await process_terabox(user_id, text, msg)
+    await journal.add(msg, user_id, links[0])
+    if not await submit_job(user_id, links[0], msg):
+        await journal.remove(msg)
+        await edit_message(msg, "🚦 <b>Bot is busy.</b> Too many jobs in the queue, please try again later.")
+        await asyncio.sleep(10)
+        await delete_message(msg)
+        return
+    auth_store.charge(user_id)
+
+def queue_notifier(msg):
+    async def on_position(position):
+        set_status(msg, position=position)
+        await edit_message(
+            msg,
+            f"╭━◝━━━━━━━━━━━━◜━╮\n"
+            f"⚡❍⊱❁ Stack Sadhu ™\n"
+            f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+            f"⏳ <b>Queued:</b> position {position}\n"
+            f"⚙️ <b>Active jobs:</b> {scheduler.active}/{scheduler.workers}\n"
+            f"✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨"
+        )
+    return on_position
+
+async def run_job(user_id, url, msg, user_dir=None, item=None):
+    key = JobJournal.key(msg)
+    # Runs as the job's own task, so the trace stays with this job and whatever it spawns
+    current_job.set(JobTrace(job_key=key, user_id=user_id, url=url, resumed=user_dir is not None))
+    job = cancellable.get(key, (None,))[0]
+    if job and job.started_at:
+        metrics.observe_stage("queue", job.started_at - job.created_at)
+    result = False
+    cancelled = False
+    try:
+        result = await process_terabox(user_id, url, msg, user_dir, item)
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        cancellable.pop(key, None)
+        if isinstance(msg, BatchMember):
+            if msg.index not in msg.batch.results:
+                msg.batch.finish(msg, "cancelled" if cancelled else "done" if result else "failed")
+            await feed_batch(msg.batch)
+        else:
+            progress.close(msg)
+    return result
+
+async def submit_job(user_id, url, msg, user_dir=None, item=None):
+    """Queue a link for processing; False when the queue is full"""
+    job_status[JobJournal.key(msg)] = {
+        "user_id": user_id, "file_name": "", "stage": "queued", "position": None,
+        "percent": 0, "speed": "", "eta": "", "size": "", "queued_at": int(time.time()),
+    }
+    try:
+        job = await scheduler.submit(
+            user_id,
+            lambda: run_job(user_id, url, msg, user_dir, item),
+            priority=PRIORITY_OWNER if user_id == BOT_OWNER_ID else PRIORITY_USER,
+            on_position=queue_notifier(msg),
+            # A batch runs several of its files at once, whatever the per-user limit
+            limit=BATCH_PARALLELISM if isinstance(msg, BatchMember) else None
+        )
+        cancellable[JobJournal.key(msg)] = (job, msg)
+        return True
+    except QueueFullError as e:
+        job_status.pop(JobJournal.key(msg), None)
+        logger.warning(f"Rejected job for {user_id}: {str(e)}")
+        return False
+
+async def show_cancelled(msg):
+    if isinstance(msg, BatchMember):
+        return
+    await edit_message(msg, "🛑 <b>Cancelled.</b> Download and upload stopped.")
+    await asyncio.sleep(5)
+    await delete_message(msg)
+
+def find_jobs(message_key=None, user_id=None):
+    """(key, Job, msg) of cancellable jobs on one status message (a batch message covers all its
+    files) and/or of one user"""
+    return [
+        (key, job, msg) for key, (job, msg) in list(cancellable.items())
+        if (message_key is None or key == message_key or key.startswith(message_key + ":"))
+        and (user_id is None or job.user_id == user_id)
+    ]
+
+async def cancel_jobs(entries):
+    """Cancel running and queued jobs; returns how many were still cancellable"""
+    count = 0
+    for key, job, msg in entries:
+        queued = job.state == "queued"
+        if not scheduler.cancel(job):
+            continue
+        count += 1
+        if queued:
+            # Never started, so none of process_terabox's cleanup will run
+            cancellable.pop(key, None)
+            job_status.pop(key, None)
+            await journal.remove(msg)
+            if isinstance(msg, BatchMember):
+                msg.batch.finish(msg, "cancelled")
+            else:
+                asyncio.create_task(show_cancelled(msg))
+        if isinstance(msg, BatchMember):
+            # Files still waiting in the batch's backlog go with it
+            count += msg.batch.drop_backlog("cancelled")
+    if count:
+        logger.info(f"🛑 Cancelled {count} jobs")
+    return count
+
+def refresh_batch(batch):
+    """Push the aggregated status of every file in ``batch`` to its message"""
+    lines = []
+    percents = []
+    for member in batch.members:
+        result = batch.results.get(member.index)
+        if result == "expanded":
+            continue
+        status = job_status.get(member.job_key, {})
+        name = status.get("file_name") or member.label
+        if result == "done":
+            percents.append(100)
+            lines.append(f"✅ <code>{name}</code>")
+        elif result == "failed":
+            percents.append(100)
+            lines.append(f"❌ <code>{name}</code>")
+        elif result == "cancelled":
+            percents.append(100)
+            lines.append(f"🛑 <code>{name}</code>")
+        elif status.get("stage") in ("downloading", "uploading"):
+            icon = "📥" if status["stage"] == "downloading" else "📤"
+            percent = status.get("percent", 0)
+            percents.append(percent / 2 if status["stage"] == "downloading" else 50 + percent / 2)
+            lines.append(f"{icon} <code>{name}</code> {percent}% {status.get('speed', '')}")
+        else:
+            percents.append(0)
+            lines.append(f"⏳ <code>{name}</code>")
+    total = len(percents)
+    done = batch.count("done")
+    failed = batch.count("failed")
+    cancelled = batch.count("cancelled")
+    overall = int(sum(percents) / total) if total else 0
+    if len(lines) > 15:
+        lines = lines[:15] + [f"… and {len(lines) - 15} more"]
+    title = "✅ <b>Batch complete</b>" if batch.finished else "📦 <b>Batch in progress</b>"
+    progress.push(
+        batch.message,
+        f"╭━◝━━━━━━━━━━━━◜━╮\n"
+        f"⚡❍⊱❁ Stack Sadhu ™\n"
+        f"╰━◞━━━━━━━━━━━━◟━╯\n\n"
+        f"{title}\n"
+        f"📂 <b>Files:</b> {done}/{total} done" + (f" | ❌ {failed} failed" if failed else "")
+        + (f" | 🛑 {cancelled} cancelled" if cancelled else "") + "\n"
+        + (f"⚠️ {batch.skipped} links skipped (limit {MAX_BATCH_SIZE})\n" if batch.skipped else "")
+        + f"🔸 {progress_bar(overall)} 🔸\n"
+        f"🚀 <b>Progress:</b> {overall}%\n\n"
+        + "\n".join(lines)
+        + "\n✨❍⭕️━━━━━━━━━━━━━━━⭕️❍✨",
+        None if batch.finished else cancel_keyboard(batch.message)
+    )
+    if batch.finished:
+        progress.close(batch.message)
+
+async def start_batch(user_id, entries, msg):
+    """Queue (url, resolved item or None) entries as one batch reporting on ``msg``"""
+    if isinstance(msg, BatchMember):
+        batch = msg.batch
+    else:
+        batch = Batch(msg, user_id)
+        batch.on_change = refresh_batch
+    room = max(0, MAX_BATCH_SIZE - len(batch.members))
+    batch.skipped += max(0, len(entries) - room)
+    members = [(url, item, batch.add(item["file_name"] if item else url.rsplit("/", 1)[-1]))
+               for url, item in entries[:room]]
+    batch.backlog.extend(members)
+    await feed_batch(batch)
+    logger.info(f"📦 Batch for {user_id}: {len(members)} files queued, {batch.skipped} skipped")
+    batch.changed()
+    return batch
+
+async def feed_batch(batch):
+    """Hand backlog files to the scheduler, keeping at most BATCH_PARALLELISM of them there
+
+    A big batch would otherwise fill the shared job queue on its own.
+    """
+    while batch.backlog and batch.in_flight < BATCH_PARALLELISM and not SHUTTING_DOWN:
+        url, item, member = batch.backlog.popleft()
+        if not await submit_job(batch.user_id, url, member, item=item):
+            batch.finish(member, "failed")
+
+async def resume_jobs():
+    """Re-queue jobs the journal says were interrupted by the last shutdown"""
+    jobs = await journal.pending()
+    if jobs:
+        logger.info(f"♻️ Resuming {len(jobs)} interrupted jobs")
+    for job in jobs:
+        try:
+            msg = await bot.get_messages(job["chat_id"], job["message_id"])
+        except Exception as e:
+            logger.warning(f"Can't load status message for {job['job_key']}: {str(e)}")
+            msg = None
+        if not msg or msg.empty:
+            await journal.discard(job["job_key"])
+            if job["user_dir"]:
+                clean_directory(job["user_dir"])
+            continue
+        user_dir = job["user_dir"] if job["user_dir"] and os.path.isdir(job["user_dir"]) else None
+        await edit_message(msg, "♻️ <b>Bot restarted, resuming your job...</b>")
+        if not await submit_job(job["user_id"], job["url"], msg, user_dir):
+            await journal.discard(job["job_key"])
+
+async def main():
+    global SHUTTING_DOWN
+    await bot.start()
+    await web_server.start()
+    watchdog.start()
+    lag_monitor = asyncio.create_task(metrics.monitor_loop_lag())
+    await resume_jobs()
+    reaper.start()
+    await idle()
+    reaper.stop()
+    lag_monitor.cancel()
+    watchdog.stop()
+    await web_server.stop()
+    SHUTTING_DOWN = True
+    await upload_pool.stop()
+    await bot.stop()
+    await auth_store.flush()
 
 # Run the bot
 if __name__ == "__main__":
@@ -678,7 +1641,7 @@ if __name__ == "__main__":
     logger.info("🚀 Starting Terabox Downloader Bot...")
     # Log the authorized users file path
     logger.info(f"Authorized users file: {AUTHORIZED_USERS_FILE}")
-    logger.info(f"Initial authorized users: {AUTHORIZED_USERS}")
+    logger.info(f"Initial authorized users: {len(auth_store)}")
 
     # Start the bot 💥
-    bot.run()
+    bot.run(main())
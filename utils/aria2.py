@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+
+import aria2p
+
+logger = logging.getLogger("terabox_bot")
+
+ARIA2_RPC_HOST = os.getenv("ARIA2_RPC_HOST", "http://localhost")
+ARIA2_RPC_PORT = int(os.getenv("ARIA2_RPC_PORT", 6800))
+ARIA2_RPC_SECRET = os.getenv("ARIA2_RPC_SECRET", "")
+ARIA2_MAX_CONCURRENT = int(os.getenv("ARIA2_MAX_CONCURRENT", 5))
+ARIA2_CONNECTIONS = int(os.getenv("ARIA2_CONNECTIONS", 16))
+# Bandwidth caps in bytes/sec, 0 = unlimited
+ARIA2_GLOBAL_LIMIT = int(os.getenv("ARIA2_GLOBAL_LIMIT", 0))
+ARIA2_JOB_LIMIT = int(os.getenv("ARIA2_JOB_LIMIT", 0))
+
+
+def _head(raw, completed, total):
+    """Bytes downloaded without a gap from the start of the file, from the piece bitfield"""
+    if completed >= total:
+        return completed
+    bitfield = raw.get("bitfield")
+    piece_length = int(raw.get("pieceLength", 0))
+    if not bitfield or not piece_length:
+        return 0
+    bits = bin(int(bitfield, 16))[2:].zfill(len(bitfield) * 4)
+    pieces = len(bits) - len(bits.lstrip("1"))
+    return min(pieces * piece_length, total)
+
+
+class Aria2Error(Exception):
+    """Raised when the aria2 daemon can't be reached or a download fails"""
+
+
+class Aria2Engine:
+    """Drives one long-lived ``aria2c --enable-rpc`` daemon for all downloads"""
+
+    def __init__(self, host=ARIA2_RPC_HOST, port=ARIA2_RPC_PORT, secret=ARIA2_RPC_SECRET,
+                 max_concurrent=ARIA2_MAX_CONCURRENT, connections=ARIA2_CONNECTIONS,
+                 global_limit=ARIA2_GLOBAL_LIMIT):
+        self.host = host
+        self.port = port
+        # Only we talk to a daemon we spawn ourselves, so a random secret is fine
+        self.secret = secret or secrets.token_hex(16)
+        self.max_concurrent = max_concurrent
+        self.connections = connections
+        self.global_limit = global_limit
+        self.client = aria2p.Client(host=host, port=port, secret=self.secret)
+        self.process = None
+        self._start_lock = None
+
+    async def _call(self, method, *args):
+        # aria2p is a blocking JSON-RPC client, keep it off the event loop
+        return await asyncio.to_thread(method, *args)
+
+    async def _alive(self):
+        try:
+            await self._call(self.client.get_version)
+            return True
+        except Exception:
+            return False
+
+    async def start(self):
+        """Spawn the daemon (once) and wait until RPC answers"""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self.process is not None and self.process.returncode is None and await self._alive():
+                return
+            command = [
+                "aria2c",
+                "--enable-rpc",
+                "--rpc-listen-all=false",
+                f"--rpc-listen-port={self.port}",
+                f"--rpc-secret={self.secret}",
+                f"--max-concurrent-downloads={self.max_concurrent}",
+                f"--max-connection-per-server={self.connections}",
+                f"--max-overall-download-limit={self.global_limit}",
+                f"--stop-with-process={os.getpid()}",
+                "--auto-file-renaming=false",
+                "--allow-overwrite=true",
+                "--continue=true",
+                "--quiet=true",
+            ]
+            self.process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            for _ in range(50):
+                if await self._alive():
+                    logger.info(f"🚀 aria2 RPC daemon running on port {self.port} (pid {self.process.pid})")
+                    return
+                if self.process.returncode is not None:
+                    break
+                await asyncio.sleep(0.1)
+            raise Aria2Error("aria2 RPC daemon failed to start")
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        try:
+            await self._call(self.client.shutdown)
+        except Exception:
+            self.process.terminate()
+        await self.process.wait()
+
+    async def add(self, url, directory, file_name, connections=None, max_speed=None,
+                  min_split_size=None, lowest_speed=None):
+        """Queue a download and return its GID; ``url`` may be a list of mirrors"""
+        await self.start()
+        connections = connections or self.connections
+        options = {
+            "dir": os.path.abspath(directory),
+            "out": file_name,
+            "split": str(connections),
+            "max-connection-per-server": str(connections),
+            "max-download-limit": str(ARIA2_JOB_LIMIT if max_speed is None else max_speed),
+        }
+        if min_split_size:
+            options["min-split-size"] = str(min_split_size)
+        if lowest_speed:
+            options["lowest-speed-limit"] = str(lowest_speed)
+        uris = [url] if isinstance(url, str) else list(url)
+        return await self._call(self.client.add_uri, uris, options)
+
+    async def status(self, gid):
+        """Structured progress for one download"""
+        raw = await self._call(self.client.tell_status, gid)
+        completed = int(raw.get("completedLength", 0))
+        total = int(raw.get("totalLength", 0))
+        speed = int(raw.get("downloadSpeed", 0))
+        return {
+            "gid": gid,
+            "status": raw.get("status"),
+            "completed": completed,
+            "head": _head(raw, completed, total),
+            "total": total,
+            "speed": speed,
+            "connections": int(raw.get("connections", 0)),
+            "percent": int(completed * 100 / total) if total else 0,
+            "eta": (total - completed) / speed if speed else None,
+            "error": raw.get("errorMessage"),
+        }
+
+    async def pause(self, gid):
+        await self._call(self.client.pause, gid)
+
+    async def resume(self, gid):
+        await self._call(self.client.unpause, gid)
+
+    async def cancel(self, gid):
+        try:
+            await self._call(self.client.force_remove, gid)
+        except Exception as e:
+            logger.warning(f"aria2 remove {gid} failed: {str(e)}")
+        await self.forget(gid)
+
+    async def forget(self, gid):
+        """Drop a finished download from aria2's result list"""
+        try:
+            await self._call(self.client.remove_download_result, gid)
+        except Exception:
+            pass
+
+    async def set_job_limits(self, gid, connections=None, max_speed=None):
+        options = {}
+        if connections is not None:
+            options["max-connection-per-server"] = str(connections)
+        if max_speed is not None:
+            options["max-download-limit"] = str(max_speed)
+        if options:
+            await self._call(self.client.change_option, gid, options)
+
+    async def set_global_limits(self, max_speed=None, max_concurrent=None):
+        options = {}
+        if max_speed is not None:
+            options["max-overall-download-limit"] = str(max_speed)
+        if max_concurrent is not None:
+            options["max-concurrent-downloads"] = str(max_concurrent)
+        if options:
+            await self._call(self.client.change_global_option, options)
+
+    async def active_count(self):
+        try:
+            return len(await self._call(self.client.tell_active, ["gid"]))
+        except Exception:
+            return 0
+
+    async def wait(self, gid, on_progress=None, interval=1, timeout=None):
+        """Poll ``gid`` until it finishes; ``on_progress`` gets each status dict"""
+        started = time.time()
+        try:
+            while True:
+                status = await self.status(gid)
+                if on_progress:
+                    await on_progress(status)
+                if status["status"] in ("complete", "error", "removed"):
+                    if status["status"] != "complete":
+                        raise Aria2Error(status["error"] or f"Download {status['status']}")
+                    return status
+                if timeout and time.time() - started > timeout:
+                    await self.cancel(gid)
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            await self.cancel(gid)
+            raise
+        finally:
+            await self.forget(gid)
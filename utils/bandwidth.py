@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("terabox_bot")
+
+# Total budgets in bytes/sec shared by all running jobs, 0 = unlimited
+DOWNLOAD_BANDWIDTH = int(os.getenv("DOWNLOAD_BANDWIDTH", 0))
+UPLOAD_BANDWIDTH = int(os.getenv("UPLOAD_BANDWIDTH", 0))
+# Fair-share weights: the owner and small files get a bigger slice
+OWNER_WEIGHT = float(os.getenv("BANDWIDTH_OWNER_WEIGHT", 4))
+SMALL_FILE_WEIGHT = float(os.getenv("BANDWIDTH_SMALL_FILE_WEIGHT", 3))
+SMALL_FILE_SIZE = int(os.getenv("BANDWIDTH_SMALL_FILE_SIZE", 100)) * 1024 * 1024
+
+
+class Throttle:
+    """One job's share of a budget; ``take`` paces bytes to the current rate
+
+    Pacing is a virtual clock rather than a bucket with a lock, so any number
+    of coroutines (download segments, upload workers) can share it. The rate
+    can change at any time; ``on_change`` lets an engine that throttles by
+    itself (aria2) follow along.
+    """
+
+    BURST_SECONDS = 1.0
+
+    def __init__(self, direction, weight, rate=0):
+        self.direction = direction
+        self.weight = weight
+        self.rate = rate
+        self.on_change = None
+        self.transferred = 0
+        self._clock = time.monotonic()
+
+    def set_rate(self, rate):
+        if rate == self.rate:
+            return
+        self.rate = rate
+        if self.on_change:
+            asyncio.ensure_future(self._notify(rate))
+
+    async def _notify(self, rate):
+        try:
+            await self.on_change(rate)
+        except Exception as e:
+            logger.warning(f"Couldn't apply {self.direction} limit: {str(e)}")
+
+    async def take(self, nbytes):
+        self.transferred += nbytes
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self._clock = max(self._clock, now - self.BURST_SECONDS) + nbytes / self.rate
+        delay = self._clock - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BandwidthManager:
+    """Splits the download and upload budgets between running jobs by weight"""
+
+    def __init__(self, download=DOWNLOAD_BANDWIDTH, upload=UPLOAD_BANDWIDTH,
+                 owner_weight=OWNER_WEIGHT, small_file_weight=SMALL_FILE_WEIGHT, small_file_size=SMALL_FILE_SIZE):
+        self.budgets = {"download": download, "upload": upload}
+        self.owner_weight = owner_weight
+        self.small_file_weight = small_file_weight
+        self.small_file_size = small_file_size
+        self._members = {"download": [], "upload": []}
+
+    def weight(self, size, owner=False):
+        weight = 1.0
+        if owner:
+            weight *= self.owner_weight
+        if size and size <= self.small_file_size:
+            weight *= self.small_file_weight
+        return weight
+
+    def join(self, direction, size, owner=False):
+        """Register a transfer and return its Throttle; pair with ``leave``"""
+        throttle = Throttle(direction, self.weight(size, owner))
+        self._members[direction].append(throttle)
+        self._rebalance(direction)
+        return throttle
+
+    def leave(self, throttle):
+        if throttle is None:
+            return
+        members = self._members[throttle.direction]
+        if throttle in members:
+            members.remove(throttle)
+            throttle.on_change = None
+            self._rebalance(throttle.direction)
+
+    def _rebalance(self, direction):
+        budget = self.budgets[direction]
+        members = self._members[direction]
+        if not budget or not members:
+            return
+        total = sum(t.weight for t in members)
+        for throttle in members:
+            throttle.set_rate(max(1, int(budget * throttle.weight / total)))
+        logger.info(
+            f"⚖️ {direction} budget {budget // 1024} KiB/s over {len(members)} jobs: "
+            + ", ".join(f"{t.rate // 1024}" for t in members)
+        )
+
+    def stats(self):
+        return {
+            direction: {
+                "budget": self.budgets[direction],
+                "jobs": len(members),
+                "rates": [t.rate for t in members],
+            }
+            for direction, members in self._members.items()
+        }
@@ -0,0 +1,101 @@
+import logging
+import os
+import re
+from collections import deque
+
+logger = logging.getLogger("terabox_bot")
+
+# Links taken from one message or .txt list
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 50))
+# Files of one batch that may run at the same time; also how many sit in the job queue,
+# the rest wait in the batch's own backlog
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", 3))
+# Largest .txt link list accepted, in KB
+MAX_LINK_FILE_SIZE = int(os.getenv("MAX_LINK_FILE_SIZE", 512)) * 1024
+
+
+def extract_links(text, pattern):
+    """Every distinct link matching ``pattern`` in ``text``, in order"""
+    links = []
+    for match in re.finditer(pattern, text or ""):
+        if match.group(0) not in links:
+            links.append(match.group(0))
+    return links
+
+
+def folder_items(data, share_id):
+    """Files of a folder share response, each keyed for the file index; None for single files"""
+    files = data.get("files") if isinstance(data, dict) else None
+    if not isinstance(files, list):
+        return None
+    items = []
+    for index, item in enumerate(files):
+        if isinstance(item, dict) and item.get("proxy_url") and item.get("file_name"):
+            key = item.get("fs_id") or f"{index}_{item['file_name']}"
+            items.append(dict(item, share_key=f"{share_id}/{key}"))
+    return items
+
+
+class BatchMember:
+    """Stands in for the status message of one file in a batch
+
+    Replies go to the batch's real message; edits and deletes are routed to
+    the batch so the chat sees one aggregated progress message.
+    """
+
+    def __init__(self, batch, index, label):
+        self.batch = batch
+        self.index = index
+        self.label = label
+        self.job_key = f"{batch.message.chat.id}:{batch.message.id}:{index}"
+
+    def __getattr__(self, name):
+        return getattr(self.batch.message, name)
+
+
+class Batch:
+    """Bookkeeping for a group of files sharing one status message"""
+
+    def __init__(self, message, user_id):
+        self.message = message
+        self.user_id = user_id
+        self.members = []
+        self.results = {}   # index -> "done" | "failed" | "expanded"
+        self.skipped = 0
+        self.backlog = deque()  # (url, item, member) not handed to the scheduler yet
+        self.on_change = None
+
+    def add(self, label):
+        member = BatchMember(self, len(self.members), label)
+        self.members.append(member)
+        return member
+
+    def finish(self, member, result):
+        self.results[member.index] = result
+        self.changed()
+
+    def changed(self):
+        if self.on_change:
+            self.on_change(self)
+
+    @property
+    def finished(self):
+        return len(self.results) == len(self.members)
+
+    @property
+    def in_flight(self):
+        """Members handed to the scheduler that haven't finished"""
+        return len(self.members) - len(self.results) - len(self.backlog)
+
+    def drop_backlog(self, result):
+        """Finish every member still waiting in the backlog; returns how many there were"""
+        dropped = list(self.backlog)
+        self.backlog.clear()
+        for _, _, member in dropped:
+            self.results[member.index] = result
+        if dropped:
+            self.changed()
+        return len(dropped)
+
+    def count(self, result):
+        return sum(1 for r in self.results.values() if r == result)
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("terabox_bot")
+
+# Free space always left untouched, in MB
+DISK_RESERVE_MARGIN = int(os.getenv("DISK_RESERVE_MARGIN", 512)) * 1024 * 1024
+# Recently downloaded files kept for retries/re-requests, in MB (0 disables the cache)
+FILE_CACHE_SIZE = int(os.getenv("FILE_CACHE_SIZE", 0)) * 1024 * 1024
+
+
+class DiskFullError(Exception):
+    """Raised when a job could never fit on the disk"""
+
+
+def allocated_bytes(path):
+    """Bytes actually allocated on disk under ``path`` (sparse/preallocated aware)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class Reservation:
+    def __init__(self, controller, size, directory):
+        self.controller = controller
+        self.size = size
+        self.directory = directory
+
+    def outstanding(self):
+        """Reserved bytes not yet written to disk"""
+        return max(0, self.size - allocated_bytes(self.directory))
+
+    def release(self):
+        self.controller._release(self)
+
+
+class DiskAdmission:
+    """Reserves expected download sizes against free disk space before jobs start"""
+
+    def __init__(self, path, margin=DISK_RESERVE_MARGIN, cache=None):
+        self.path = path
+        self.margin = margin
+        self.cache = cache
+        self._reservations = []
+        self._cond = None
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def free(self):
+        return shutil.disk_usage(self.path).free
+
+    def _available(self, reservations):
+        return self.free() - sum(r.outstanding() for r in reservations) - self.margin
+
+    async def available(self):
+        """Free bytes not promised to a running job; walks the job directories in a thread"""
+        return await asyncio.to_thread(self._available, list(self._reservations))
+
+    @property
+    def reserved(self):
+        return sum(r.size for r in self._reservations)
+
+    async def reserve(self, size, directory, on_wait=None, poll=5):
+        """Wait until ``size`` bytes fit, then hold them for ``directory``'s job"""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        usage = shutil.disk_usage(self.path)
+        if size > usage.total - self.margin:
+            raise DiskFullError(f"Needs {size} bytes, disk only has {usage.total}")
+        started = time.monotonic()
+        waited = False
+        async with self._cond:
+            while True:
+                available = await self.available()
+                if available >= size:
+                    break
+                # Cached files are the cheapest thing to give up
+                if self.cache and await self.cache.shrink(size - available):
+                    continue
+                if not waited:
+                    waited = True
+                    self.waits += 1
+                    logger.info(f"💽 Waiting for {size} bytes of disk space ({available} available)")
+                    if on_wait:
+                        await on_wait()
+                # Other processes may free space too, so poll as well as wait for releases
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=poll)
+                except asyncio.TimeoutError:
+                    pass
+            reservation = Reservation(self, size, directory)
+            self._reservations.append(reservation)
+        if waited:
+            self.wait_seconds += time.monotonic() - started
+        return reservation
+
+    def _release(self, reservation):
+        if reservation in self._reservations:
+            self._reservations.remove(reservation)
+            if self._cond is not None:
+                asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+
+class FileCache:
+    """Size-bounded LRU of completed downloads, keyed by share ID and size"""
+
+    def __init__(self, root, max_bytes=FILE_CACHE_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (path, size)
+        self._pins = {}
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @property
+    def total(self):
+        return sum(size for _, size in self._entries.values())
+
+    @staticmethod
+    def _key(share_id, file_size):
+        return f"{share_id}_{file_size}"
+
+    def _load(self):
+        found = []
+        for key in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, key)
+            files = os.listdir(entry_dir) if os.path.isdir(entry_dir) else []
+            if len(files) != 1:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            path = os.path.join(entry_dir, files[0])
+            found.append((os.path.getmtime(path), key, path, os.path.getsize(path)))
+        for _, key, path, size in sorted(found):
+            self._entries[key] = (path, size)
+        logger.info(f"File cache: {len(self._entries)} files, {self.total} bytes")
+
+    def lookup(self, share_id, file_size):
+        """Path of a cached copy (pinned until ``unpin``), or None"""
+        if not self.enabled:
+            return None
+        key = self._key(share_id, file_size)
+        entry = self._entries.get(key)
+        if not entry or not os.path.exists(entry[0]):
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._pins[key] = self._pins.get(key, 0) + 1
+        self.hits += 1
+        return entry[0]
+
+    async def unpin(self, share_id, file_size):
+        key = self._key(share_id, file_size)
+        if self._pins.get(key, 0) > 1:
+            self._pins[key] -= 1
+        else:
+            self._pins.pop(key, None)
+        await self._remove(self._evict())
+
+    async def store(self, share_id, file_size, src_path):
+        """Move a finished download into the cache (same filesystem, so it's a rename)
+
+        ``file_size`` is the size Terabox reported and stays the key; the file
+        itself may differ after a faststart remux, so it's accounted by its own size.
+        """
+        if not self.enabled or not os.path.exists(src_path):
+            return False
+        size = os.path.getsize(src_path)
+        key = self._key(share_id, file_size)
+        if size > self.max_bytes or key in self._entries:
+            return False
+        entry_dir = os.path.join(self.root, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, os.path.basename(src_path))
+        os.replace(src_path, path)
+        self._entries[key] = (path, size)
+        await self._remove(self._evict())
+        return True
+
+    def _drop(self, key):
+        path, size = self._entries.pop(key)
+        logger.info(f"🗑️ Evicted {key} from file cache")
+        return os.path.dirname(path), size
+
+    def _evict(self):
+        """Forget entries over ``max_bytes``; returns their directories for ``_remove``"""
+        dirs = []
+        for key in list(self._entries):
+            if self.total <= self.max_bytes:
+                break
+            if key not in self._pins:
+                dirs.append(self._drop(key)[0])
+        return dirs
+
+    @staticmethod
+    async def _remove(dirs):
+        # Entries are already forgotten on the loop; only the deletes go to a thread
+        def remove():
+            for entry_dir in dirs:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+        if dirs:
+            await asyncio.to_thread(remove)
+
+    async def shrink(self, nbytes):
+        """Evict least recently used files until ``nbytes`` are freed; returns bytes freed"""
+        freed = 0
+        dirs = []
+        for key in list(self._entries):
+            if freed >= nbytes:
+                break
+            if key not in self._pins:
+                entry_dir, size = self._drop(key)
+                dirs.append(entry_dir)
+                freed += size
+        await self._remove(dirs)
+        return freed
+
+    def stats(self):
+        return {
+            "files": len(self._entries),
+            "bytes": self.total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
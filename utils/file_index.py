@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("terabox_bot")
+
+FILE_INDEX_DB = os.getenv("FILE_INDEX_DB", "file_index.db")
+# Seconds a job waits on another job's copy of the same file before fetching it itself
+INFLIGHT_WAIT = int(os.getenv("INFLIGHT_WAIT", 3600))
+
+
+class FileIndex:
+    """Persistent (share ID, size) -> Telegram file_id index with in-flight coalescing"""
+
+    def __init__(self, path=FILE_INDEX_DB):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " share_id TEXT NOT NULL,"
+            " file_size INTEGER NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " media_type TEXT NOT NULL,"
+            " file_name TEXT,"
+            " hits INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (share_id, file_size))"
+        )
+        self._conn.commit()
+        self._inflight = {}  # (share_id, file_size) -> Future[file_id | None]
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        logger.info(f"File index loaded: {self.path}")
+
+    def _get(self, share_id, file_size):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, media_type, file_name FROM files WHERE share_id = ? AND file_size = ?",
+                (share_id, file_size),
+            ).fetchone()
+            if row:
+                self._conn.execute(
+                    "UPDATE files SET hits = hits + 1 WHERE share_id = ? AND file_size = ?",
+                    (share_id, file_size),
+                )
+                self._conn.commit()
+        if not row:
+            return None
+        return {"file_id": row[0], "media_type": row[1], "file_name": row[2]}
+
+    def _put(self, share_id, file_size, file_id, media_type, file_name):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (share_id, file_size, file_id, media_type, file_name, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (share_id, file_size, file_id, media_type, file_name, time.time()),
+            )
+            self._conn.commit()
+
+    def _discard(self, share_id, file_size):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM files WHERE share_id = ? AND file_size = ?",
+                (share_id, file_size),
+            )
+            self._conn.commit()
+
+    async def get(self, share_id, file_size):
+        entry = await asyncio.to_thread(self._get, share_id, file_size)
+        if entry:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    async def put(self, share_id, file_size, file_id, media_type, file_name=None):
+        await asyncio.to_thread(self._put, share_id, file_size, file_id, media_type, file_name)
+        logger.info(f"📇 Indexed {share_id} ({file_size} bytes) -> {media_type}")
+
+    async def discard(self, share_id, file_size):
+        await asyncio.to_thread(self._discard, share_id, file_size)
+        logger.warning(f"Dropped stale file_id for {share_id} ({file_size} bytes)")
+
+    def inflight(self, share_id, file_size):
+        """Return the pending job future for this file, if another job is already on it"""
+        future = self._inflight.get((share_id, file_size))
+        if future is not None:
+            self.coalesced += 1
+        return future
+
+    def claim(self, share_id, file_size):
+        """Mark this file as being processed unless another job already is
+
+        Returns ``(key, None)`` when the caller got the file (pass ``key`` to
+        ``release``), or ``(None, future)`` of the job that already has it.
+        """
+        key = (share_id, file_size)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return None, future
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        return key, None
+
+    async def wait(self, future, timeout=INFLIGHT_WAIT):
+        """Entry published by the job holding ``future``; None if it failed or took too long"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Gave up waiting {timeout}s for another job on the same file")
+            return None
+
+    def release(self, key, entry=None):
+        """Wake up coalesced waiters with the indexed entry (or None on failure)"""
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(entry)
+
+    def stats(self):
+        with self._lock:
+            total = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "entries": total,
+        }
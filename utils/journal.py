@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("terabox_bot")
+
+JOB_JOURNAL_DB = os.getenv("JOB_JOURNAL_DB", "jobs.db")
+
+STAGES = ("queued", "resolving", "downloading", "uploading", "done")
+
+
+class JobJournal:
+    """Persistent record of in-progress jobs so they can be resumed after a restart"""
+
+    def __init__(self, path=JOB_JOURNAL_DB):
+        self.path = os.path.abspath(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_key TEXT PRIMARY KEY,"
+            " user_id INTEGER NOT NULL,"
+            " chat_id INTEGER NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " url TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " user_dir TEXT,"
+            " file_name TEXT,"
+            " file_size INTEGER,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        logger.info(f"Job journal loaded: {self.path}")
+
+    @staticmethod
+    def key(msg):
+        # Batch members share one chat message and carry their own key
+        return getattr(msg, "job_key", None) or f"{msg.chat.id}:{msg.id}"
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+            self._conn.commit()
+        return rows
+
+    async def add(self, msg, user_id, url):
+        now = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO jobs (job_key, user_id, chat_id, message_id, url, stage, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (self.key(msg), user_id, msg.chat.id, msg.id, url, now, now),
+        )
+
+    async def update(self, msg, stage, **fields):
+        """Move a job to ``stage`` and record any of user_dir/file_name/file_size"""
+        if stage not in STAGES:
+            raise ValueError(f"Unknown job stage: {stage}")
+        columns = {k: v for k, v in fields.items() if k in ("user_dir", "file_name", "file_size")}
+        assignments = ", ".join(["stage = ?", "updated_at = ?"] + [f"{k} = ?" for k in columns])
+        await asyncio.to_thread(
+            self._execute,
+            f"UPDATE jobs SET {assignments} WHERE job_key = ?",
+            (stage, time.time(), *columns.values(), self.key(msg)),
+        )
+
+    async def remove(self, msg):
+        await self.discard(self.key(msg))
+
+    async def discard(self, job_key):
+        await asyncio.to_thread(self._execute, "DELETE FROM jobs WHERE job_key = ?", (job_key,))
+
+    async def pending(self):
+        """Unfinished jobs, oldest first"""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT job_key, user_id, chat_id, message_id, url, stage, user_dir, file_name, file_size"
+            " FROM jobs WHERE stage != 'done' ORDER BY created_at",
+        )
+        fields = ("job_key", "user_id", "chat_id", "message_id", "url", "stage", "user_dir", "file_name", "file_size")
+        return [dict(zip(fields, row)) for row in rows]
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+
+from pyrogram.errors import FloodWait
+
+from utils.logs import detached_task
+from utils.metrics import stage
+
+logger = logging.getLogger("terabox_bot")
+
+LOG_CHANNEL_QUEUE_SIZE = int(os.getenv("LOG_CHANNEL_QUEUE_SIZE", 1000))
+# Seconds between two posts, keeps the channel well under Telegram's limits
+LOG_CHANNEL_INTERVAL = float(os.getenv("LOG_CHANNEL_INTERVAL", 1.5))
+
+
+class LogChannelMirror:
+    """Mirrors sent files to the log channel by file_id from a background queue"""
+
+    def __init__(self, client, chat_id, parse_mode=None,
+                 max_queue=LOG_CHANNEL_QUEUE_SIZE, interval=LOG_CHANNEL_INTERVAL):
+        self.client = client
+        self.chat_id = int(chat_id) if chat_id and str(chat_id).lstrip("-").isdigit() else chat_id
+        self.parse_mode = parse_mode
+        self.max_queue = max_queue
+        self.interval = interval
+        self._queue = None
+        self._task = None
+        self.posted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+
+    @property
+    def enabled(self):
+        return bool(self.chat_id)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def post(self, file_id, caption):
+        """Queue a copy of an already uploaded file; never blocks the caller"""
+        if not self.enabled:
+            return
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = detached_task(self._run())
+        try:
+            self._queue.put_nowait((file_id, caption))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Log channel queue is full, dropping post")
+
+    async def _run(self):
+        while True:
+            file_id, caption = await self._queue.get()
+            try:
+                await self._send(file_id, caption)
+            finally:
+                self._queue.task_done()
+            await asyncio.sleep(self.interval)
+
+    async def _send(self, file_id, caption):
+        for _ in range(3):
+            try:
+                with stage("log_copy"):
+                    await self.client.send_cached_media(
+                        chat_id=self.chat_id,
+                        file_id=file_id,
+                        caption=caption,
+                        parse_mode=self.parse_mode
+                    )
+                self.posted += 1
+                return
+            except FloodWait as e:
+                # Only this queue waits, user jobs are unaffected
+                self.flood_waits += 1
+                self.flood_wait_seconds += e.value
+                logger.warning(f"Log channel FloodWait: sleeping {e.value}s")
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logger.error(f"Failed to send file to log channel: {str(e)}")
+                break
+        self.failed += 1
+
+    def stats(self):
+        return {
+            "queued": self.queue_depth,
+            "posted": self.posted,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
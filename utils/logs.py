@@ -0,0 +1,142 @@
+import asyncio
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import time
+
+logger = logging.getLogger("terabox_bot")
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_MB", 20)) * 1024 * 1024
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Trace of the job the current task is working on; asyncio tasks and to_thread calls inherit it
+current_job = contextvars.ContextVar("current_job", default=None)
+
+_listener = None
+
+
+class JobFilter(logging.Filter):
+    """Stamps records with the current job's trace ID (runs in the logging task's context)"""
+
+    def filter(self, record):
+        trace = current_job.get()
+        record.job = trace.id if trace else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra={"fields": {...}}`` adds top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "job", None):
+            entry["job"] = record.job
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=LOG_LEVEL, path=LOG_FILE, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    """Route every logger through one queue; a background thread writes the console and the file
+
+    Safe to call more than once, only the first call configures anything.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    if path:
+        rotating = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+        )
+        rotating.setFormatter(JsonFormatter())
+        handlers.append(rotating)
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(JobFilter())
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class JobTrace:
+    """Per-job trace ID plus the stage timings and bytes that go into its summary record"""
+
+    def __init__(self, **fields):
+        self.id = secrets.token_hex(4)
+        self.fields = fields
+        self.stages = {}
+        self.bytes = {}
+        self.started = time.monotonic()
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = round(self.stages.get(name, 0) + seconds, 3)
+
+    def add_bytes(self, direction, nbytes):
+        self.bytes[direction] = self.bytes.get(direction, 0) + nbytes
+
+    def summary(self, outcome):
+        total = time.monotonic() - self.started
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.stages.items())
+        logger.info(
+            f"🧾 Job {self.id} {outcome} in {total:.1f}s" + (f" ({stages})" if stages else ""),
+            extra={"fields": {
+                "event": "job_summary", **self.fields, "outcome": outcome, "seconds": round(total, 3),
+                "stages": self.stages, "bytes": self.bytes,
+            }}
+        )
+
+
+def detached_task(coro):
+    """Start a long-lived service task outside whatever job happens to start it"""
+    return contextvars.Context().run(asyncio.create_task, coro)
+
+
+def annotate(**fields):
+    trace = current_job.get()
+    if trace:
+        trace.fields.update(fields)
+
+
+def note_stage(name, seconds):
+    trace = current_job.get()
+    if trace:
+        trace.add_stage(name, seconds)
+
+
+def note_bytes(direction, nbytes):
+    trace = current_job.get()
+    if trace:
+        trace.add_bytes(direction, nbytes)
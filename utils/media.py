@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+
+logger = logging.getLogger("terabox_bot")
+
+# Max ffprobe/ffmpeg processes running at once
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", 2))
+MEDIA_TIMEOUT = int(os.getenv("MEDIA_TIMEOUT", 180))
+# Bytes from the start of a file that are usually enough to read the container header
+PROBE_HEAD_BYTES = int(os.getenv("PROBE_HEAD_BYTES", 8 * 1024 * 1024))
+# 🎬 Stream-copy videos into MP4 with the moov atom up front so playback starts right away.
+# Off by default: it needs ffmpeg and room for a second copy, and keeps only the first video track
+FASTSTART = os.getenv("FASTSTART", "False").lower() == "true"
+# Remuxes are long, disk-bound ffmpeg runs; their own pool keeps them from starving probes
+REMUX_WORKERS = int(os.getenv("REMUX_WORKERS", 1))
+REMUX_TIMEOUT = int(os.getenv("REMUX_TIMEOUT", 1800))
+
+MP4_EXTENSIONS = (".mp4", ".m4v", ".mov")
+REMUX_EXTENSIONS = (".mkv", ".avi", ".flv")
+# Codecs MP4 can carry as-is, so a container change needs no re-encode
+MP4_VIDEO_CODECS = ("h264", "hevc", "mpeg4", "av1")
+MP4_AUDIO_CODECS = ("aac", "mp3", "ac3", "eac3")
+
+_semaphore = None
+_remux_semaphore = None
+# PIDs of tools run_tool is still waiting on, so the reaper leaves them alone
+running = set()
+
+
+def _limiter():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MEDIA_WORKERS)
+    return _semaphore
+
+
+def remux_limiter():
+    """Pool for long, disk-bound ffmpeg runs (remuxes, video splits)"""
+    global _remux_semaphore
+    if _remux_semaphore is None:
+        _remux_semaphore = asyncio.Semaphore(REMUX_WORKERS)
+    return _remux_semaphore
+
+
+async def run_tool(command, stdin_data=None, timeout=MEDIA_TIMEOUT, limiter=None):
+    """Run ffprobe/ffmpeg without blocking the event loop; returns (returncode, stdout)"""
+    async with limiter or _limiter():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            # Missing or unrunnable tool: callers fall back as on any other failure
+            logger.warning(f"⚠️ Couldn't run {command[0]}: {str(e)}")
+            return -1, b""
+        running.add(process.pid)
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(stdin_data), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.warning(f"⚠️ {command[0]} timed out after {timeout}s")
+            return -1, b""
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        except BrokenPipeError:
+            # ffprobe may stop reading stdin once it has the header
+            await process.wait()
+            return process.returncode, b""
+        finally:
+            running.discard(process.pid)
+        return process.returncode, stdout
+
+
+def _parse_probe(output):
+    info = {"duration": 0, "width": 0, "height": 0, "codec": None, "audio_codec": None}
+    try:
+        data = json.loads(output or b"{}")
+    except ValueError:
+        return info
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and not info["codec"]:
+            info["width"] = int(stream.get("width") or 0)
+            info["height"] = int(stream.get("height") or 0)
+            info["codec"] = stream.get("codec_name")
+            if not info["duration"] and stream.get("duration"):
+                info["duration"] = int(float(stream["duration"]))
+        elif stream.get("codec_type") == "audio" and not info["audio_codec"]:
+            info["audio_codec"] = stream.get("codec_name")
+    duration = data.get("format", {}).get("duration")
+    if duration:
+        try:
+            info["duration"] = int(float(duration))
+        except ValueError:
+            pass
+    return info
+
+
+PROBE_COMMAND = [
+    "ffprobe",
+    "-v", "error",
+    "-show_entries", "format=duration:stream=codec_type,codec_name,width,height,duration",
+    "-of", "json",
+]
+
+
+async def probe(file_path):
+    """Duration, width, height and codec of a media file in one ffprobe call"""
+    code, output = await run_tool(PROBE_COMMAND + [file_path])
+    if code != 0:
+        logger.warning(f"⚠️ ffprobe failed for {file_path}")
+    return _parse_probe(output)
+
+
+async def probe_head(file_path, head_bytes=PROBE_HEAD_BYTES):
+    """Probe from the first ``head_bytes`` of a file that may still be downloading"""
+    def read_head():
+        with open(file_path, "rb") as f:
+            return f.read(head_bytes)
+
+    try:
+        head = await asyncio.to_thread(read_head)
+    except OSError:
+        return None
+    if not head.strip(b"\0"):
+        return None
+    code, output = await run_tool(PROBE_COMMAND + ["-i", "pipe:0"], stdin_data=head)
+    info = _parse_probe(output)
+    return info if info["duration"] and info["width"] else None
+
+
+async def generate_thumbnail(file_path, thumb_path, duration=0):
+    """Grab one frame (10% in, capped at 10s) as a JPEG thumbnail"""
+    offset = min(10, duration * 0.1) if duration else 1
+    code, _ = await run_tool([
+        "ffmpeg",
+        "-v", "error",
+        "-y",
+        "-ss", f"{offset:.2f}",
+        "-i", file_path,
+        "-frames:v", "1",
+        "-vf", "scale=320:-2",
+        "-q:v", "4",
+        thumb_path
+    ])
+    if code != 0 or not os.path.exists(thumb_path):
+        logger.warning(f"⚠️ Thumbnail generation failed for {file_path}")
+        return None
+    return thumb_path
+
+
+def moov_position(file_path):
+    """"front" or "end" for where an MP4's moov box sits relative to mdat, None if unknown
+
+    Walks the top-level box headers only, a handful of small reads.
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= size:
+            f.seek(offset)
+            header = f.read(16)
+            box_size, box_type = struct.unpack(">I4s", header[:8])
+            if box_size == 1:
+                if len(header) < 16:
+                    return None
+                box_size = struct.unpack(">Q", header[8:16])[0]
+            elif box_size == 0:
+                box_size = size - offset
+            if box_size < 8:
+                return None
+            if box_type == b"moov":
+                return "front"
+            if box_type == b"mdat":
+                return "end"
+            offset += box_size
+    return None
+
+
+async def remux_reason(file_path, info):
+    """Why ``file_path`` should be remuxed before upload, or None when it streams fine already"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in MP4_EXTENSIONS:
+        try:
+            position = await asyncio.to_thread(moov_position, file_path)
+        except OSError:
+            return None
+        return "moov atom at the end" if position == "end" else None
+    if ext in REMUX_EXTENSIONS and info and info.get("codec") in MP4_VIDEO_CODECS \
+            and info.get("audio_codec") in MP4_AUDIO_CODECS + (None,):
+        return f"{ext[1:]} container"
+    return None
+
+
+async def faststart(file_path, info, reason=""):
+    """Stream-copy into an MP4 with moov first; returns the path to upload (the input on failure)"""
+    root, ext = os.path.splitext(file_path)
+    ext = ext.lower()
+    in_place = ext in MP4_EXTENSIONS
+    out_path = f"{root}.faststart{ext}" if in_place else f"{root}.mp4"
+    if not in_place and os.path.exists(out_path):
+        out_path = f"{root}.remux.mp4"
+    command = [
+        "ffmpeg",
+        "-v", "error",
+        "-y",
+        "-i", file_path,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c", "copy",
+    ]
+    if info and info.get("codec") == "hevc":
+        # Apple players only accept HEVC in MP4 under this tag
+        command += ["-tag:v", "hvc1"]
+    command += ["-movflags", "+faststart", "-f", "mov" if ext == ".mov" else "mp4", out_path]
+    code, _ = await run_tool(command, timeout=REMUX_TIMEOUT, limiter=remux_limiter())
+    if code != 0 or not os.path.exists(out_path) or not os.path.getsize(out_path):
+        logger.warning(f"⚠️ Faststart remux failed for {file_path}, uploading as-is")
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        return file_path
+    if in_place:
+        os.replace(out_path, file_path)
+        out_path = file_path
+    else:
+        os.remove(file_path)
+    logger.info(f"🎬 Remuxed {os.path.basename(out_path)} for streaming ({reason})")
+    return out_path
@@ -0,0 +1,208 @@
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.logs import note_stage, note_bytes
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Settable value, or one computed on scrape from ``func``
+
+    ``func`` may return a number or a {label: number} dict; pass
+    ``kind="counter"`` when it reads a monotonically increasing total.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, doc, labelnames=(), func=None, kind=None):
+        super().__init__(name, doc, labelnames)
+        self.func = func
+        if kind:
+            self.kind = kind
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.func is None:
+            return super().samples()
+        try:
+            result = self.func()
+        except Exception:
+            return []
+        if isinstance(result, dict):
+            return [(self.name, (label,), value) for label, value in result.items()]
+        return [(self.name, (), result)]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.buckets = sorted(buckets)
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                out.append((f"{self.name}_bucket", key + (bound,), cumulative, self.labelnames + ("le",)))
+            out.append((f"{self.name}_bucket", key + ("+Inf",), data[-1], self.labelnames + ("le",)))
+            out.append((f"{self.name}_sum", key, data[-2]))
+            out.append((f"{self.name}_count", key, data[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, doc, labelnames=()):
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name, doc, labelnames=(), func=None, kind=None):
+        return self.register(Gauge(name, doc, labelnames, func, kind))
+
+    def histogram(self, name, doc, buckets, labelnames=()):
+        return self.register(Histogram(name, doc, buckets, labelnames))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.doc}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample in metric.samples():
+                name, key, value = sample[:3]
+                names = sample[3] if len(sample) > 3 else metric.labelnames
+                lines.append(f"{name}{_labels(names, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+THROUGHPUT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100)  # MiB/s
+
+stage_seconds = REGISTRY.histogram(
+    "terabox_stage_seconds", "Time spent in each pipeline stage", STAGE_BUCKETS, ("stage",))
+stage_failures = REGISTRY.counter(
+    "terabox_stage_failures_total", "Pipeline stage failures", ("stage",))
+jobs_total = REGISTRY.counter(
+    "terabox_jobs_total", "Finished jobs by outcome", ("outcome",))
+bytes_total = REGISTRY.counter(
+    "terabox_bytes_total", "Bytes transferred", ("direction",))
+throughput = REGISTRY.histogram(
+    "terabox_throughput_mibps", "Per-job transfer throughput in MiB/s", THROUGHPUT_BUCKETS, ("direction",))
+active_downloads = REGISTRY.gauge(
+    "terabox_active_downloads", "Downloads currently running", ("engine",))
+loop_lag = REGISTRY.histogram(
+    "terabox_event_loop_lag_seconds", "Event loop scheduling delay",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+loop_lag_last = REGISTRY.gauge(
+    "terabox_event_loop_lag_last_seconds", "Most recent event loop scheduling delay")
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage and count it as failed if it raises"""
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        stage_failures.inc(stage=name)
+        raise
+    finally:
+        observe_stage(name, time.monotonic() - started)
+
+
+def observe_stage(name, seconds):
+    """Record a stage duration, also in the running job's summary"""
+    stage_seconds.observe(seconds, stage=name)
+    note_stage(name, seconds)
+
+
+def record_transfer(direction, nbytes, seconds):
+    bytes_total.inc(nbytes, direction=direction)
+    note_bytes(direction, nbytes)
+    if seconds > 0:
+        throughput.observe(nbytes / seconds / 1024 / 1024, direction=direction)
+
+
+async def monitor_loop_lag(interval=0.5):
+    """Measure how late the loop wakes us up; run as a background task"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
@@ -0,0 +1,46 @@
+import asyncio
+
+
+class ByteWatermark:
+    """Tracks how many leading bytes of a file are on disk so a reader can follow the writer"""
+
+    def __init__(self, total=None):
+        self.total = total
+        self.available = 0
+        self.error = None
+        self._cond = asyncio.Condition()
+        self._ready = asyncio.Event()
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def update(self, available):
+        if available > self.available:
+            self.available = available
+            asyncio.ensure_future(self._notify())
+
+    def set_total(self, total):
+        self.total = total
+        self._ready.set()
+
+    def fail(self, error):
+        self.error = error
+        self._ready.set()
+        asyncio.ensure_future(self._notify())
+
+    async def ready(self):
+        """Wait until the file is preallocated (total known) or the download failed"""
+        await self._ready.wait()
+        if self.error:
+            raise self.error
+        return self.total
+
+    async def wait_for(self, offset):
+        """Block until the first ``offset`` bytes are written (capped at the file size)"""
+        if self.total is not None:
+            offset = min(offset, self.total)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.error is not None or self.available >= offset)
+        if self.available < offset and self.error:
+            raise self.error
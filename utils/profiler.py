@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+logger = logging.getLogger("terabox_bot")
+
+# Log the loop thread's stack whenever a callback holds the loop this long (0 disables)
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", 0))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 120))
+
+
+def _frame_names(frame):
+    """Root-first ``file:function`` names for a frame's stack"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class BlockingDetector:
+    """Watchdog thread that reports what the event loop is running when it stalls
+
+    The loop stamps a heartbeat every ``threshold / 4`` seconds; when the
+    heartbeat goes stale the watchdog grabs the loop thread's current
+    stack, so the log shows the blocking call itself rather than whatever
+    ran after it.
+    """
+
+    def __init__(self, threshold=LOOP_BLOCK_THRESHOLD):
+        self.threshold = threshold
+        self.blocks = 0
+        self.blocked_seconds = 0.0
+        self.longest = 0.0
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self):
+        if not self.enabled or self._task:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(f"🐢 Loop watchdog on: reporting stalls over {self.threshold}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold:
+                if reported is not None:
+                    # Heartbeat is back: account for the whole stall
+                    total = beat - reported
+                    self.blocked_seconds += total
+                    self.longest = max(self.longest, total)
+                    logger.warning(f"🐢 Event loop was blocked for ~{total:.2f}s")
+                    reported = None
+                continue
+            if reported == beat:
+                continue
+            reported = beat
+            self.blocks += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)"
+            logger.warning(f"🐢 Event loop blocked for {stalled:.2f}s, loop thread is at:\n{stack}")
+
+    def stats(self):
+        return {
+            "threshold": self.threshold,
+            "blocks": self.blocks,
+            "blocked_seconds": round(self.blocked_seconds, 2),
+            "longest": round(self.longest, 2),
+        }
+
+
+class SamplingProfiler:
+    """On-demand wall-clock sampler writing collapsed stacks for flamegraph.pl / speedscope"""
+
+    def __init__(self, directory=PROFILE_DIR, interval=PROFILE_INTERVAL, max_seconds=PROFILE_MAX_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = None
+
+    @property
+    def running(self):
+        return self._lock is not None and self._lock.locked()
+
+    def _sample(self, seconds):
+        me = threading.get_ident()
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = threads.get(ident) or str(ident)
+                stacks[";".join([name] + _frame_names(frame))] += 1
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+    async def profile(self, seconds):
+        """Sample every thread for ``seconds``; returns (path, samples)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            raise RuntimeError("A profile is already running")
+        seconds = max(1, min(int(seconds), self.max_seconds))
+        async with self._lock:
+            logger.info(f"🔬 Sampling profile for {seconds}s")
+            stacks, samples = await asyncio.to_thread(self._sample, seconds)
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+            lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+            await asyncio.to_thread(self._write, path, "\n".join(lines) + "\n")
+            logger.info(f"🔬 Profile written to {path} ({samples} samples)")
+            return path, samples
+
+    @staticmethod
+    def _write(path, text):
+        with open(path, "w") as f:
+            f.write(text)
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import time
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from utils.logs import detached_task
+
+logger = logging.getLogger("terabox_bot")
+
+# Minimum seconds between two edits in the same chat
+PROGRESS_CHAT_INTERVAL = float(os.getenv("PROGRESS_CHAT_INTERVAL", 3))
+# Edits per second across all chats
+PROGRESS_GLOBAL_RATE = float(os.getenv("PROGRESS_GLOBAL_RATE", 20))
+
+
+class ProgressEditor:
+    """Single service that owns every status-message edit
+
+    Jobs ``push`` the latest text for a message and return immediately. A
+    background task flushes edits under a per-chat interval and a global token
+    bucket, dropping stale intermediate states and identical text, and backs
+    off for everyone when Telegram answers with FloodWait.
+    """
+
+    def __init__(self, chat_interval=PROGRESS_CHAT_INTERVAL, global_rate=PROGRESS_GLOBAL_RATE, parse_mode=None):
+        self.chat_interval = chat_interval
+        self.global_rate = max(0.1, global_rate)
+        self.parse_mode = parse_mode
+        self._pending = {}     # (chat_id, message_id) -> (message, text, reply_markup)
+        self._sent_text = {}   # (chat_id, message_id) -> last text on screen
+        self._chat_next = {}   # chat_id -> monotonic time of the next allowed edit
+        self._tokens = self.global_rate
+        self._tokens_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._wakeup = None
+        self._task = None
+        self._inflight = {}    # (chat_id, message_id) -> edit task on the wire
+        self._dropped = set()  # keys forgotten while an edit was still in flight
+        self._closing = set()  # keys to release once their last edit is out
+        self.edits = 0
+        self.superseded = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+
+    @staticmethod
+    def _key(message):
+        return (message.chat.id, message.id)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = detached_task(self._run())
+
+    def push(self, message, text, reply_markup=None):
+        """Record the latest text (and inline keyboard) for ``message``; never blocks"""
+        key = self._key(message)
+        if key in self._pending:
+            self.superseded += 1
+        elif self._sent_text.get(key) == text:
+            self.duplicates += 1
+            return
+        self._pending[key] = (message, text, reply_markup)
+        self._ensure_started()
+        self._wakeup.set()
+
+    def forget(self, message):
+        """Drop queued state for a message that is about to be deleted"""
+        key = self._key(message)
+        self._pending.pop(key, None)
+        self._sent_text.pop(key, None)
+        self._closing.discard(key)
+        if key in self._inflight:
+            self._dropped.add(key)
+
+    def close(self, message):
+        """Release state for a message that stays on screen but won't be edited again
+
+        A queued final edit still goes out first.
+        """
+        key = self._key(message)
+        if key in self._pending or key in self._inflight:
+            self._closing.add(key)
+        else:
+            self._sent_text.pop(key, None)
+
+    def _settle(self, key):
+        # Called when a key has nothing queued or in flight any more
+        if key in self._closing and key not in self._pending:
+            self._closing.discard(key)
+            self._sent_text.pop(key, None)
+
+    def _refill(self, now):
+        self._tokens = min(self.global_rate, self._tokens + (now - self._tokens_at) * self.global_rate)
+        self._tokens_at = now
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            self._refill(now)
+            next_due = now + 1
+            for key, (message, text, reply_markup) in list(self._pending.items()):
+                chat_due = self._chat_next.get(key[0], 0)
+                if chat_due > now:
+                    next_due = min(next_due, chat_due)
+                    continue
+                if self._tokens < 1:
+                    next_due = min(next_due, now + (1 - self._tokens) / self.global_rate)
+                    break
+                del self._pending[key]
+                if self._sent_text.get(key) == text:
+                    self.duplicates += 1
+                    if key not in self._inflight:
+                        self._settle(key)
+                    continue
+                self._tokens -= 1
+                self._chat_next[key[0]] = now + self.chat_interval
+                task = asyncio.create_task(self._edit(key, message, text, reply_markup))
+                self._inflight[key] = task
+
+            # Forget chats whose interval has long expired
+            if len(self._chat_next) > 1000:
+                self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.05, next_due - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def _remember(self, key, text):
+        if key in self._dropped:
+            self._dropped.discard(key)
+        else:
+            self._sent_text[key] = text
+
+    async def _edit(self, key, message, text, reply_markup=None):
+        try:
+            await message.edit_text(text, parse_mode=self.parse_mode, reply_markup=reply_markup)
+            self._remember(key, text)
+            self.edits += 1
+        except MessageNotModified:
+            self._remember(key, text)
+        except FloodWait as e:
+            self.flood_waits += 1
+            self.flood_wait_seconds += e.value
+            logger.warning(f"FloodWait on progress edit: pausing edits for {e.value}s")
+            self._blocked_until = max(self._blocked_until, time.monotonic() + e.value)
+            # Retry later unless a newer state arrived or the message is gone
+            if key in self._dropped:
+                self._dropped.discard(key)
+            else:
+                self._pending.setdefault(key, (message, text, reply_markup))
+            self._wakeup.set()
+        except Exception as e:
+            self.errors += 1
+            self._dropped.discard(key)
+            logger.error(f"Error editing message: {str(e)}")
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+                self._dropped.discard(key)
+                self._settle(key)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "edits": self.edits,
+            "superseded": self.superseded,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_seconds,
+        }
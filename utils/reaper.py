@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+import psutil
+
+logger = logging.getLogger("terabox_bot")
+
+REAPER_INTERVAL = int(os.getenv("REAPER_INTERVAL", 600))
+# Job directories untouched for this long are left over from dead jobs (downloads time out after 2h)
+STALE_DIR_AGE = int(os.getenv("STALE_DIR_AGE", 3 * 3600))
+# Our own ffprobe/ffmpeg children that no job is waiting on and are older than this are stuck
+STUCK_PROCESS_AGE = int(os.getenv("STUCK_PROCESS_AGE", 900))
+
+TOOLS = ("aria2c", "ffprobe", "ffmpeg")
+
+
+def _dir_mtime(path):
+    """Newest mtime of a directory and anything directly inside it"""
+    newest = os.path.getmtime(path)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                newest = max(newest, entry.stat(follow_symlinks=False).st_mtime)
+            except OSError:
+                pass
+    return newest
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Reaper:
+    """Periodically kills orphaned helper processes and removes stale job directories
+
+    A process counts as orphaned when it's aria2c/ffprobe/ffmpeg owned by us
+    and either works on our download directory or RPC port without being our
+    child (left behind by an earlier run), or is our own ffprobe/ffmpeg child
+    that has outlived ``stuck_age`` with no job waiting on it. The live aria2
+    daemon and every tool a job is still running (``protected_pids``) are
+    never touched; those jobs enforce their own timeouts.
+    """
+
+    def __init__(self, download_dir, protected_pids=None, protected_dirs=None, rpc_port=None,
+                 interval=REAPER_INTERVAL, stale_age=STALE_DIR_AGE, stuck_age=STUCK_PROCESS_AGE):
+        self.download_dir = os.path.abspath(download_dir)
+        self.protected_pids = protected_pids or (lambda: set())
+        self.protected_dirs = protected_dirs
+        self.rpc_port = rpc_port
+        self.interval = interval
+        self.stale_age = stale_age
+        self.stuck_age = stuck_age
+        self.killed = 0
+        self.removed = 0
+        self.freed = 0
+        self.runs = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error(f"Reaper run failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def run(self):
+        """One sweep; returns (processes killed, directories removed)"""
+        protected = {os.path.abspath(d) for d in (await self.protected_dirs() if self.protected_dirs else ())}
+        killed = await asyncio.to_thread(self._reap_processes, set(self.protected_pids()))
+        removed, freed = await asyncio.to_thread(self._reap_dirs, protected)
+        self.runs += 1
+        self.killed += killed
+        self.removed += removed
+        self.freed += freed
+        if killed or removed:
+            logger.info(f"🧟 Reaper: killed {killed} orphaned processes, removed {removed} stale dirs "
+                        f"({freed / (1024 * 1024):.1f} MiB)")
+        return killed, removed
+
+    def _works_in_download_dir(self, args, cwd):
+        """Whether any argument (or ``--opt=value``) is a path inside the download directory"""
+        for arg in args:
+            for value in (arg, arg.partition("=")[2]):
+                if not value:
+                    continue
+                if not os.path.isabs(value):
+                    # Tools get job paths relative to whatever directory their bot ran in
+                    if not cwd:
+                        continue
+                    value = os.path.join(cwd, value)
+                path = os.path.normpath(value)
+                if path == self.download_dir or path.startswith(self.download_dir + os.sep):
+                    return True
+        return False
+
+    def _is_orphan(self, process, me, uid, now):
+        info = process.info
+        if info["name"] not in TOOLS or info["pid"] == me or info["uids"] is None or info["uids"].real != uid:
+            return False
+        if info["ppid"] == me:
+            return info["name"] != "aria2c" and now - info["create_time"] > self.stuck_age
+        if self._works_in_download_dir(info["cmdline"] or (), info["cwd"]):
+            return True
+        cmdline = " ".join(info["cmdline"] or ())
+        return (info["name"] == "aria2c" and self.rpc_port is not None
+                and f"--rpc-listen-port={self.rpc_port}" in cmdline)
+
+    def _reap_processes(self, protected):
+        me = os.getpid()
+        uid = os.getuid()
+        now = time.time()
+        killed = 0
+        for process in psutil.process_iter(["pid", "ppid", "name", "cmdline", "uids", "create_time", "cwd"]):
+            if process.info["pid"] in protected:
+                continue
+            try:
+                if not self._is_orphan(process, me, uid, now):
+                    continue
+                logger.warning(f"🧟 Killing orphaned {process.info['name']} (pid {process.info['pid']})")
+                process.kill()
+                killed += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        return killed
+
+    def _reap_dirs(self, protected):
+        if not os.path.isdir(self.download_dir):
+            return 0, 0
+        cutoff = time.time() - self.stale_age
+        removed = freed = 0
+        with os.scandir(self.download_dir) as entries:
+            candidates = [e.path for e in entries if e.name.startswith("user_") and e.is_dir(follow_symlinks=False)]
+        for path in candidates:
+            if path in protected:
+                continue
+            try:
+                if _dir_mtime(path) > cutoff:
+                    continue
+                size = _dir_size(path)
+                shutil.rmtree(path)
+            except OSError as e:
+                logger.warning(f"Couldn't remove stale {path}: {str(e)}")
+                continue
+            logger.info(f"🧟 Removed stale job dir {path}")
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def stats(self):
+        return {"runs": self.runs, "killed": self.killed, "removed": self.removed, "freed": self.freed}
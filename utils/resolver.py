@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+import aiohttp
+
+logger = logging.getLogger("terabox_bot")
+
+RESOLVER_CACHE_TTL = int(os.getenv("RESOLVER_CACHE_TTL", 600))
+RESOLVER_TIMEOUT = int(os.getenv("RESOLVER_TIMEOUT", 30))
+RESOLVER_RETRIES = int(os.getenv("RESOLVER_RETRIES", 3))
+RESOLVER_BACKOFF = float(os.getenv("RESOLVER_BACKOFF", 1.0))
+RESOLVER_POOL_SIZE = int(os.getenv("RESOLVER_POOL_SIZE", 20))
+
+
+class ResolverError(Exception):
+    """Raised when the Terabox API can't resolve a link"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def _retrieve(task):
+    # The lookup can outlive every caller; keep its error from being reported as unretrieved
+    if not task.cancelled():
+        task.exception()
+
+
+class TeraboxResolver:
+    """Async Terabox API client with a pooled session and a TTL cache per share ID"""
+
+    def __init__(self, api_base, link_regex, ttl=RESOLVER_CACHE_TTL, timeout=RESOLVER_TIMEOUT,
+                 retries=RESOLVER_RETRIES, backoff=RESOLVER_BACKOFF, pool_size=RESOLVER_POOL_SIZE):
+        self.api_base = api_base
+        self.link_regex = re.compile(link_regex)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self._cache = OrderedDict()  # share_id -> (expires_at, data), oldest first
+        self._inflight = {}          # share_id -> Task shared by concurrent lookups
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.requests = 0
+        self.latency_total = 0.0
+        self.latency_last = 0.0
+
+    def share_id(self, url):
+        """Canonical share ID of a Terabox link (falls back to the URL itself)"""
+        match = self.link_regex.search(url)
+        return match.group(2) if match else url
+
+    async def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=min(10, self.timeout)),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def resolve(self, url):
+        """Return the API payload for ``url``, served from cache when possible"""
+        key = self.share_id(url)
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self.hits += 1
+            logger.info(f"⚡ Resolver cache hit: {key}")
+            return cached[1]
+        self._cache.pop(key, None)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(self._lookup(key, url))
+            task.add_done_callback(_retrieve)
+            self._inflight[key] = task
+        # Shielded: a caller that gets cancelled leaves the lookup running for the others
+        return await asyncio.shield(task)
+
+    async def _lookup(self, key, url):
+        try:
+            data = await self._fetch(url)
+            self._store(key, data)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    def _store(self, key, data):
+        now = time.monotonic()
+        # Every entry gets the same TTL, so the oldest insert expires first
+        while self._cache:
+            oldest = next(iter(self._cache))
+            if self._cache[oldest][0] > now:
+                break
+            del self._cache[oldest]
+        self._cache.pop(key, None)
+        self._cache[key] = (now + self.ttl, data)
+
+    async def _fetch(self, url):
+        api_url = self.api_base + quote(url)
+        session = await self.session()
+        last_error = None
+        for attempt in range(1, self.retries + 1):
+            started = time.monotonic()
+            self.requests += 1
+            try:
+                async with session.get(api_url) as response:
+                    if response.status == 200:
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            # Not JSON at all, e.g. an HTML error page
+                            data = None
+                        self._record_latency(started)
+                        # Single files carry proxy_url, folder shares a "files" list
+                        if isinstance(data, dict) and ("proxy_url" in data or isinstance(data.get("files"), list)):
+                            return data
+                        last_error = ResolverError("Unexpected API response", response.status)
+                        break
+                    self._record_latency(started)
+                    last_error = ResolverError(f"API returned {response.status}", response.status)
+                    # Client errors won't fix themselves on retry
+                    if response.status < 500 and response.status != 429:
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._record_latency(started)
+                last_error = ResolverError(f"API request failed: {e!r}")
+            if attempt < self.retries:
+                delay = self.backoff * (2 ** (attempt - 1))
+                logger.warning(f"Resolver attempt {attempt} failed ({last_error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        self.errors += 1
+        raise last_error
+
+    async def fetch_bytes(self, url):
+        """Fetch a small resource (e.g. a thumbnail) over the pooled session"""
+        session = await self.session()
+        async with session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    def _record_latency(self, started):
+        self.latency_last = time.monotonic() - started
+        self.latency_total += self.latency_last
+
+    def invalidate(self, url):
+        self._cache.pop(self.share_id(url), None)
+
+    def stats(self):
+        avg = self.latency_total / self.requests if self.requests else 0.0
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "requests": self.requests,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "latency_avg": avg,
+            "latency_last": self.latency_last,
+            "latency_total": self.latency_total,
+            "saved_seconds": (self.hits + self.coalesced) * avg,
+            "cached": len(self._cache),
+        }
@@ -0,0 +1,183 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import os
+import time
+from collections import defaultdict
+
+from utils.logs import detached_task
+
+logger = logging.getLogger("terabox_bot")
+
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 3))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", 1))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", 50))
+
+PRIORITY_OWNER = 0
+PRIORITY_USER = 1
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at its depth limit"""
+
+
+class Job:
+    def __init__(self, job_id, user_id, priority, factory, on_position=None, limit=None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.priority = priority
+        self.factory = factory
+        self.on_position = on_position
+        self.limit = limit
+        self.state = "queued"
+        self.position = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+        self.result = None
+
+
+class JobScheduler:
+    """Bounded worker pool with a priority FIFO queue and per-user concurrency limits"""
+
+    def __init__(self, workers=MAX_CONCURRENT_JOBS, per_user=MAX_JOBS_PER_USER, max_queue=MAX_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.per_user = max(1, per_user)
+        self.max_queue = max_queue
+        self._queue = []                   # sorted (priority, seq, job)
+        self._running = {}                 # job_id -> Job
+        self._user_running = defaultdict(int)
+        self._seq = itertools.count(1)
+        self._cond = None
+        self._worker_tasks = []
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def start(self):
+        if self._worker_tasks:
+            return
+        self._cond = asyncio.Condition()
+        for i in range(self.workers):
+            self._worker_tasks.append(detached_task(self._worker(i)))
+        logger.info(f"🧵 Job scheduler started: {self.workers} workers, {self.per_user} per user, queue {self.max_queue}")
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    @property
+    def active(self):
+        return len(self._running)
+
+    def jobs(self):
+        """Running jobs first, then queued jobs in dispatch order"""
+        return list(self._running.values()) + [job for _, _, job in self._queue]
+
+    async def submit(self, user_id, factory, priority=PRIORITY_USER, on_position=None, limit=None):
+        """Queue ``factory()`` (a coroutine function) and return its Job
+
+        ``limit`` overrides the per-user concurrency for this job, e.g. for batches.
+        """
+        self.start()
+        if self.max_queue and len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Queue is full ({len(self._queue)} jobs waiting)")
+        seq = next(self._seq)
+        job = Job(seq, user_id, priority, factory, on_position, limit)
+        async with self._cond:
+            bisect.insort(self._queue, (priority, seq, job))
+            self._cond.notify_all()
+        self._publish_positions()
+        return job
+
+    def cancel(self, job):
+        """Drop a queued job or cancel a running one; False if it already finished"""
+        if job.state == "queued":
+            for i, (_, _, queued) in enumerate(self._queue):
+                if queued is job:
+                    del self._queue[i]
+                    break
+            job.state = "cancelled"
+            job.finished_at = time.time()
+            self.cancelled += 1
+            self._publish_positions()
+            return True
+        if job.state == "running" and job.task and not job.task.done():
+            job.task.cancel()
+            return True
+        return False
+
+    def _next_job(self):
+        for i, (_, _, job) in enumerate(self._queue):
+            if self._user_running.get(job.user_id, 0) < (job.limit or self.per_user):
+                del self._queue[i]
+                return job
+        return None
+
+    def _publish_positions(self):
+        for position, (_, _, job) in enumerate(self._queue, start=1):
+            if job.position != position:
+                job.position = position
+                if job.on_position:
+                    asyncio.create_task(self._safe_position(job, position))
+
+    async def _safe_position(self, job, position):
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.warning(f"Queue position update failed for job {job.job_id}: {str(e)}")
+
+    async def _worker(self, index):
+        while True:
+            async with self._cond:
+                job = self._next_job()
+                while job is None:
+                    await self._cond.wait()
+                    job = self._next_job()
+                job.state = "running"
+                job.position = 0
+                job.started_at = time.time()
+                self._running[job.job_id] = job
+                self._user_running[job.user_id] += 1
+            self._publish_positions()
+            logger.info(f"▶️ Worker {index} started job {job.job_id} for user {job.user_id} "
+                        f"(waited {job.started_at - job.created_at:.1f}s)")
+            try:
+                # Run in its own task so a job can be cancelled without killing the worker
+                job.task = asyncio.create_task(job.factory())
+                job.result = await job.task
+                job.state = "done"
+                self.completed += 1
+            except asyncio.CancelledError:
+                if not job.task.cancelled():
+                    raise
+                job.state = "cancelled"
+                self.cancelled += 1
+                logger.info(f"Job {job.job_id} was cancelled")
+            except Exception as e:
+                job.state = "failed"
+                self.failed += 1
+                logger.exception(f"Job {job.job_id} crashed: {str(e)}")
+            finally:
+                job.finished_at = time.time()
+                async with self._cond:
+                    self._running.pop(job.job_id, None)
+                    self._user_running[job.user_id] -= 1
+                    if self._user_running[job.user_id] <= 0:
+                        del self._user_running[job.user_id]
+                    self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "queued": self.queue_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+        }
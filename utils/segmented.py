@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import aiohttp
+
+logger = logging.getLogger("terabox_bot")
+
+SEGMENT_COUNT = int(os.getenv("SEGMENT_COUNT", 8))
+SEGMENT_MIN_SIZE = int(os.getenv("SEGMENT_MIN_SIZE", 4 * 1024 * 1024))
+SEGMENT_RETRIES = int(os.getenv("SEGMENT_RETRIES", 5))
+SEGMENT_CHUNK_SIZE = int(os.getenv("SEGMENT_CHUNK_SIZE", 256 * 1024))
+
+
+class SegmentedDownloadError(Exception):
+    """Raised when a segmented download can't be completed"""
+
+
+async def _run_all(coros):
+    """Run ``coros`` together; on the first failure the rest are cancelled and awaited
+
+    Every segment writes through the same fd, so none may still be running
+    when the caller closes it.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class SegmentedDownloader:
+    """Pure-Python HTTP Range downloader writing each chunk straight to its file offset"""
+
+    def __init__(self, segments=SEGMENT_COUNT, min_segment_size=SEGMENT_MIN_SIZE,
+                 retries=SEGMENT_RETRIES, chunk_size=SEGMENT_CHUNK_SIZE):
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.retries = max(1, retries)
+        self.chunk_size = chunk_size
+
+    async def _probe(self, session, url):
+        """Return (size, accepts_ranges) using a one-byte range request"""
+        async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+            if response.status == 206:
+                content_range = response.headers.get("Content-Range", "")
+                total = content_range.rpartition("/")[2]
+                return (int(total) if total.isdigit() else None), True
+            if response.status == 200:
+                return response.content_length, False
+            raise SegmentedDownloadError(f"Probe failed with HTTP {response.status}")
+
+    def _plan(self, size):
+        count = max(1, min(self.segments, size // max(1, self.min_segment_size)))
+        step = -(-size // count)
+        return [[start, min(start + step, size) - 1] for start in range(0, size, step)]
+
+    def _plan_sequential(self, size):
+        step = max(1, self.min_segment_size)
+        return [[start, min(start + step, size) - 1] for start in range(0, size, step)]
+
+    def _advance(self, state, segments, watermark):
+        """Move the contiguous-bytes watermark past every finished leading segment"""
+        index = state["head"]
+        while index < len(segments) and state["progress"][index] >= segments[index][1] - segments[index][0] + 1:
+            index += 1
+        state["head"] = index
+        if index < len(segments):
+            watermark.update(segments[index][0] + state["progress"][index])
+        else:
+            watermark.update(segments[-1][1] + 1)
+
+    async def _fetch_sequential(self, session, url, fd, segments, state, watermark):
+        """Fetch small segments in file order with a sliding window of workers"""
+        state["head"] = 0
+        self._advance(state, segments, watermark)
+        pending = iter(range(len(segments)))
+
+        async def worker():
+            for index in pending:
+                await self._fetch_segment(session, url, fd, segments, index, state, watermark)
+
+        await _run_all(worker() for _ in range(min(self.segments, len(segments))))
+
+    def _load_control(self, control_path, size):
+        """Segment plan and progress saved by an interrupted download, if it matches"""
+        try:
+            with open(control_path) as f:
+                control = json.load(f)
+            if control.get("size") == size:
+                return control["segments"], control["progress"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None, None
+
+    def _save_control(self, control_path, size, segments, state):
+        try:
+            with open(control_path, "w") as f:
+                json.dump({"size": size, "segments": segments, "progress": state["progress"]}, f)
+        except OSError as e:
+            logger.warning(f"Couldn't save download control file: {str(e)}")
+
+    async def _fetch_segment(self, session, url, fd, segments, index, state, watermark=None):
+        segment = segments[index]
+        end = segment[1]
+        start = segment[0] + state["progress"][index]
+        for attempt in range(1, self.retries + 1):
+            if start > end:
+                return
+            headers = {"Range": f"bytes={start}-{end}"}
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status != 206:
+                        raise SegmentedDownloadError(f"Range request returned HTTP {response.status}")
+                    state["connections"] += 1
+                    try:
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            chunk = chunk[:end - start + 1]
+                            os.pwrite(fd, chunk, start)
+                            start += len(chunk)
+                            state["completed"] += len(chunk)
+                            state["progress"][index] += len(chunk)
+                            if watermark is not None:
+                                self._advance(state, segments, watermark)
+                            if state["throttle"]:
+                                await state["throttle"].take(len(chunk))
+                            if start > end:
+                                break
+                    finally:
+                        state["connections"] -= 1
+                if start > end:
+                    return
+                raise SegmentedDownloadError("Segment ended early")
+            except (aiohttp.ClientError, asyncio.TimeoutError, SegmentedDownloadError) as e:
+                if attempt == self.retries:
+                    raise SegmentedDownloadError(f"Segment {segment[0]}-{end} failed: {e!r}")
+                logger.warning(f"Segment {segment[0]}-{end} attempt {attempt} failed at {start}: {e!r}")
+                await asyncio.sleep(min(30, 2 ** (attempt - 1)))
+
+    async def _fetch_single(self, session, url, fd, state):
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise SegmentedDownloadError(f"HTTP {response.status}")
+            offset = 0
+            state["connections"] = 1
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                state["completed"] += len(chunk)
+                if state["throttle"]:
+                    await state["throttle"].take(len(chunk))
+            state["connections"] = 0
+
+    def _head(self, state, segments):
+        """Bytes on disk without a gap from the start of the file"""
+        if not segments:
+            return state["completed"]
+        for segment, done in zip(segments, state["progress"]):
+            if done < segment[1] - segment[0] + 1:
+                return segment[0] + done
+        return segments[-1][1] + 1
+
+    def _status(self, state, total, speed, segments=None):
+        completed = state["completed"]
+        return {
+            "status": state["status"],
+            "completed": completed,
+            "head": self._head(state, segments),
+            "total": total,
+            "speed": speed,
+            "connections": state["connections"],
+            "percent": int(completed * 100 / total) if total else 0,
+            "eta": (total - completed) / speed if speed and total else None,
+            "error": None,
+        }
+
+    async def download(self, url, path, size=None, on_progress=None, interval=1, timeout=None, watermark=None,
+                       throttle=None):
+        """Download ``url`` to ``path``; ``on_progress`` gets aria2-style status dicts
+
+        With a ``ByteWatermark`` the file is fetched front to back and the watermark
+        follows the contiguous prefix on disk, so an uploader can read behind it.
+        Segment progress is checkpointed to ``<path>.seg`` so an interrupted
+        download picks up where it stopped. A ``Throttle`` paces every chunk.
+        """
+        state = {"completed": 0, "connections": 0, "status": "active", "throttle": throttle}
+        try:
+            return await self._download(url, path, size, on_progress, interval, timeout, watermark, state)
+        except BaseException as e:
+            if watermark is not None:
+                watermark.fail(e if isinstance(e, Exception) else SegmentedDownloadError("Download cancelled"))
+            raise
+
+    async def _download(self, url, path, size, on_progress, interval, timeout, watermark, state):
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+        connector = aiohttp.TCPConnector(limit=self.segments, force_close=False)
+        async with aiohttp.ClientSession(timeout=client_timeout, connector=connector) as session:
+            probed_size, ranged = await self._probe(session, url)
+            size = probed_size or size
+            if watermark is not None and not (size and ranged):
+                raise SegmentedDownloadError("Server doesn't support range requests, can't pipeline")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            control_path = path + ".seg"
+            segments = None
+            try:
+                if size and ranged:
+                    segments, progress = self._load_control(control_path, size)
+                    if segments and os.fstat(fd).st_size == size:
+                        state["progress"] = progress
+                        state["completed"] = sum(progress)
+                        logger.info(f"Resuming {path} at {state['completed']}/{size} bytes")
+                    else:
+                        segments = self._plan_sequential(size) if watermark is not None else self._plan(size)
+                        state["progress"] = [0] * len(segments)
+                        # Preallocate so every segment can pwrite at its own offset
+                        if hasattr(os, "posix_fallocate"):
+                            os.posix_fallocate(fd, 0, size)
+                        else:
+                            os.ftruncate(fd, size)
+                        self._save_control(control_path, size, segments, state)
+                    if watermark is not None:
+                        watermark.set_total(size)
+                        work = self._fetch_sequential(session, url, fd, segments, state, watermark)
+                    else:
+                        work = _run_all(
+                            self._fetch_segment(session, url, fd, segments, index, state)
+                            for index in range(len(segments))
+                        )
+                else:
+                    os.ftruncate(fd, 0)
+                    work = self._fetch_single(session, url, fd, state)
+                work = asyncio.ensure_future(work)
+                started = last_time = time.monotonic()
+                last_completed = 0
+                try:
+                    while not work.done():
+                        done, _ = await asyncio.wait({work}, timeout=interval)
+                        now = time.monotonic()
+                        speed = int((state["completed"] - last_completed) / max(now - last_time, 1e-6))
+                        last_completed, last_time = state["completed"], now
+                        if done:
+                            break
+                        if timeout and now - started > timeout:
+                            raise asyncio.TimeoutError()
+                        if segments:
+                            self._save_control(control_path, size, segments, state)
+                        if on_progress:
+                            await on_progress(self._status(state, size, speed, segments))
+                    work.result()
+                finally:
+                    if not work.done():
+                        work.cancel()
+                        await asyncio.gather(work, return_exceptions=True)
+                    if segments:
+                        self._save_control(control_path, size, segments, state)
+                state["status"] = "complete"
+                if segments:
+                    os.remove(control_path)
+                if on_progress:
+                    elapsed = max(time.monotonic() - started, 1e-6)
+                    await on_progress(self._status(
+                        state, size or state["completed"], int(state["completed"] / elapsed), segments
+                    ))
+            finally:
+                os.close(fd)
+        return state["completed"]
+
+
+async def _main(url, path):
+    downloader = SegmentedDownloader()
+    started = time.monotonic()
+    total = await downloader.download(url, path)
+    elapsed = time.monotonic() - started
+    print(f"{total} bytes in {elapsed:.2f}s ({total / elapsed / 1024 / 1024:.2f} MiB/s)")
+
+
+if __name__ == "__main__":
+    # Quick benchmark: python -m utils.segmented <url> <output>
+    asyncio.run(_main(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,156 @@
+import io
+import json
+import logging
+import os
+
+from utils.media import run_tool, remux_limiter
+
+logger = logging.getLogger("terabox_bot")
+
+
+class FileSlice(io.RawIOBase):
+    """Read-only view of ``length`` bytes of a file starting at ``offset``
+
+    Pyrogram uploads from any binary file object, so a slice lets us send a raw
+    byte range of the downloaded file without writing a copy of it.
+    """
+
+    def __init__(self, path, offset, length, name):
+        super().__init__()
+        self._fp = open(path, "rb")
+        self.offset = offset
+        self.length = length
+        self.name = name
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self._pos = max(0, min(pos, self.length))
+        return self._pos
+
+    def read(self, size=-1):
+        remaining = self.length - self._pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        self._fp.seek(self.offset + self._pos)
+        data = self._fp.read(size)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+        super().close()
+
+
+def part_name(file_name, index, count):
+    base, ext = os.path.splitext(file_name)
+    return f"{base}.part{index:02d}of{count:02d}{ext}"
+
+
+def part_count(size, part_size):
+    return -(-size // part_size)
+
+
+async def byte_parts(file_path, file_name, part_size, slots=None):
+    """Yield (index, FileSlice) for raw byte ranges of the file
+
+    With ``slots``, a slot is taken before each part; the consumer releases it.
+    """
+    size = os.path.getsize(file_path)
+    count = part_count(size, part_size)
+    for index in range(count):
+        if slots:
+            await slots.acquire()
+        offset = index * part_size
+        length = min(part_size, size - offset)
+        yield index + 1, FileSlice(file_path, offset, length, part_name(file_name, index + 1, count))
+
+
+async def keyframes(file_path):
+    """(seconds from the start, byte offset) of every video keyframe, read from packet headers"""
+    code, output = await run_tool([
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,pos,flags:format=start_time",
+        "-of", "json=c=1",
+        file_path
+    ], timeout=1800, limiter=remux_limiter())
+    try:
+        data = json.loads(output or b"{}")
+        start = float(data.get("format", {}).get("start_time") or 0)
+        return [
+            (float(packet["pts_time"]) - start, int(packet["pos"]))
+            for packet in data.get("packets", [])
+            if "K" in packet.get("flags", "") and "pts_time" in packet and "pos" in packet
+        ] if code == 0 else []
+    except (ValueError, KeyError):
+        return []
+
+
+def plan_cuts(points, size, limit):
+    """Start times of parts cut at keyframes so every part's byte span stays under ``limit``"""
+    cuts, cut_pos = [0.0], 0
+    previous = None
+    for time, pos in points[1:] + [(None, size)]:
+        if pos - cut_pos > limit:
+            if previous is None or previous[1] <= cut_pos or pos - previous[1] > limit:
+                raise RuntimeError("A single keyframe interval is bigger than a part")
+            cuts.append(previous[0])
+            cut_pos = previous[1]
+        previous = (time, pos)
+    return cuts
+
+
+async def video_parts(file_path, file_name, out_dir, part_size, slots=None):
+    """Yield (index, path) for playable stream-copied video parts, cut one at a time
+
+    Parts start on keyframes picked from the packet index, so they join up
+    without gaps. Each part is cut only once a slot is free (the consumer
+    releases it after uploading and deleting the part), so no more than
+    ``slots`` parts sit on disk next to the source.
+    """
+    points = await keyframes(file_path)
+    if not points:
+        raise RuntimeError("ffprobe couldn't list keyframes")
+    # Leave room for the container overhead the byte offsets don't show
+    cuts = plan_cuts(points, os.path.getsize(file_path), int(part_size * 0.95))
+    ext = os.path.splitext(file_name)[1].lower()
+    for index, start in enumerate(cuts, 1):
+        if slots:
+            await slots.acquire()
+        path = os.path.join(out_dir, part_name(file_name, index, len(cuts)))
+        command = ["ffmpeg", "-v", "error", "-y", "-ss", f"{start:.6f}", "-i", file_path]
+        if index < len(cuts):
+            command += ["-t", f"{cuts[index] - start:.6f}"]
+        command += ["-map", "0:v:0", "-map", "0:a?", "-c", "copy", "-avoid_negative_ts", "make_zero"]
+        if ext in (".mp4", ".mov"):
+            command += ["-movflags", "+faststart"]
+        try:
+            code, _ = await run_tool(command + [path], timeout=1800, limiter=remux_limiter())
+            if code != 0 or not os.path.exists(path):
+                raise RuntimeError(f"ffmpeg couldn't cut part {index}")
+            if os.path.getsize(path) > part_size:
+                raise RuntimeError(f"Part {index} came out over the size limit")
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            if slots:
+                slots.release()
+            raise
+        yield index, path
@@ -0,0 +1,252 @@
+import logging
+import math
+import os
+import time
+from urllib.parse import urlparse
+
+from utils.aria2 import Aria2Error, ARIA2_CONNECTIONS
+from utils.segmented import SegmentedDownloader, SegmentedDownloadError
+
+logger = logging.getLogger("terabox_bot")
+
+# Connections all running downloads may open to one host together
+DOWNLOAD_HOST_CONNECTIONS = int(os.getenv("DOWNLOAD_HOST_CONNECTIONS", 32))
+# Per-job speed worth aiming for in bytes/sec; 0 means "as fast as the connections allow"
+DOWNLOAD_TARGET_SPEED = int(os.getenv("DOWNLOAD_TARGET_SPEED", 0))
+# No progress for this long counts as a stall
+DOWNLOAD_STALL_SECONDS = int(os.getenv("DOWNLOAD_STALL_SECONDS", 30))
+# aria2 drops connections slower than this and moves to the next mirror URL
+DOWNLOAD_LOWEST_SPEED = int(os.getenv("DOWNLOAD_LOWEST_SPEED", 10 * 1024))
+
+MB = 1024 * 1024
+# (file size up to, connections)
+SIZE_TIERS = ((8 * MB, 1), (64 * MB, 4), (512 * MB, 8))
+# Resolver fields that may carry another URL for the same file
+ALTERNATE_URL_FIELDS = ("direct_link", "download_link", "dlink", "fast_download_link")
+
+
+class DownloadStalled(Exception):
+    """Raised from the progress hook to abandon a URL that stopped moving"""
+
+
+def alternate_urls(data):
+    """``proxy_url`` first, then any other download URLs the resolver returned"""
+    urls = []
+    for field in ("proxy_url",) + ALTERNATE_URL_FIELDS:
+        url = data.get(field)
+        if isinstance(url, str) and url.startswith("http") and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _host(url):
+    return urlparse(url).netloc
+
+
+class HostStats:
+    def __init__(self):
+        self.per_connection = 0.0  # EWMA bytes/sec per connection
+        self.samples = 0
+        self.active = 0
+        self.stalls = 0
+        self.failures = 0
+
+    def record(self, speed):
+        self.per_connection = speed if not self.samples else 0.7 * self.per_connection + 0.3 * speed
+        self.samples += 1
+
+
+class DownloadPolicy:
+    """Picks connections and split sizes per download from size, load and host throughput"""
+
+    def __init__(self, max_connections=ARIA2_CONNECTIONS, host_connections=DOWNLOAD_HOST_CONNECTIONS,
+                 target_speed=DOWNLOAD_TARGET_SPEED):
+        self.max_connections = max(1, max_connections)
+        self.host_connections = max(1, host_connections)
+        self.target_speed = target_speed
+        self.hosts = {}
+
+    def host(self, url):
+        return self.hosts.setdefault(_host(url), HostStats())
+
+    def plan(self, url, size):
+        """Connections, split count and minimum split size for one download"""
+        host = self.host(url)
+        reasons = []
+        connections = self.max_connections
+        for limit, tier in SIZE_TIERS:
+            if size <= limit:
+                connections = tier
+                break
+        reasons.append(f"size tier {connections}")
+
+        # Share the host's budget with the downloads already running against it
+        share = max(1, self.host_connections // (host.active + 1))
+        if share < connections:
+            connections = share
+            reasons.append(f"{host.active} active on host, share {share}")
+
+        # Enough measured throughput per connection means fewer connections do the job
+        if self.target_speed and host.samples and host.per_connection > 0:
+            needed = max(1, math.ceil(self.target_speed / host.per_connection))
+            if needed < connections:
+                connections = needed
+                reasons.append(f"host does {host.per_connection / MB:.1f} MiB/s per connection")
+
+        connections = max(1, min(connections, self.max_connections))
+        # aria2 accepts 1M..1024M; four splits per connection keeps slow ones from holding the tail
+        min_split = min(1024, max(1, size // (connections * 4 * MB))) * MB
+        return {
+            "connections": connections,
+            "split": connections,
+            "min_split_size": min_split,
+            "reason": ", ".join(reasons),
+        }
+
+    def started(self, url):
+        self.host(url).active += 1
+
+    def finished(self, url, nbytes, seconds, connections):
+        host = self.host(url)
+        host.active = max(0, host.active - 1)
+        if nbytes and seconds > 0:
+            host.record(nbytes / seconds / max(1, connections))
+
+    def stats(self):
+        return {
+            name: {
+                "active": h.active,
+                "per_connection": int(h.per_connection),
+                "samples": h.samples,
+                "stalls": h.stalls,
+                "failures": h.failures,
+            }
+            for name, h in self.hosts.items()
+        }
+
+
+class AdaptiveDownloader:
+    """Runs a download on either engine under a ``DownloadPolicy``
+
+    Stalls first get more connections (aria2 only, segment plans are fixed
+    once started) and then a switch to the next URL; both engines resume the
+    partial file, so a switch costs no already-downloaded bytes.
+    """
+
+    def __init__(self, policy, aria2, segmented, stall_seconds=DOWNLOAD_STALL_SECONDS,
+                 lowest_speed=DOWNLOAD_LOWEST_SPEED):
+        self.policy = policy
+        self.aria2 = aria2
+        self.segmented = segmented
+        self.stall_seconds = stall_seconds
+        self.lowest_speed = lowest_speed
+
+    def _watch(self, on_progress, on_stall):
+        """Wrap a progress hook with stall detection"""
+        last = {"completed": -1, "since": time.monotonic(), "level": 0}
+
+        async def hook(status):
+            now = time.monotonic()
+            if status["completed"] != last["completed"]:
+                last.update(completed=status["completed"], since=now, level=0)
+            elif now - last["since"] >= self.stall_seconds * (last["level"] + 1):
+                last["level"] += 1
+                await on_stall(last["level"], status)
+            if on_progress:
+                await on_progress(status)
+
+        return hook
+
+    async def download(self, urls, directory, file_name, size, engine="aria2",
+                       on_progress=None, interval=1, timeout=None, throttle=None):
+        path = os.path.join(directory, file_name)
+        started = time.monotonic()
+        last_error = None
+        for attempt, url in enumerate(urls):
+            plan = self.policy.plan(url, size)
+            host = self.policy.host(url)
+            logger.info(
+                f"🎛️ {file_name}: {engine} via {_host(url)} with {plan['connections']} connections, "
+                f"min split {plan['min_split_size'] // MB} MiB ({plan['reason']})"
+            )
+            self.policy.started(url)
+            url_started = time.monotonic()
+            completed = 0
+            remaining = timeout - (url_started - started) if timeout else None
+            try:
+                if engine == "python":
+                    completed = await self._python(url, path, size, plan, on_progress, interval, remaining,
+                                                   attempt < len(urls) - 1, throttle)
+                else:
+                    completed = await self._aria2(urls[attempt:], directory, file_name, plan, on_progress,
+                                                  interval, remaining, attempt < len(urls) - 1, throttle)
+                elapsed = time.monotonic() - url_started
+                logger.info(
+                    f"🎛️ {file_name}: {completed / MB:.1f} MiB in {elapsed:.1f}s "
+                    f"({completed / max(elapsed, 1e-6) / MB:.2f} MiB/s, {plan['connections']} connections)"
+                )
+                return completed
+            except DownloadStalled as e:
+                host.stalls += 1
+                last_error = e
+                logger.warning(f"🎛️ {file_name}: {_host(url)} stalled, trying the next URL")
+            except (Aria2Error, SegmentedDownloadError) as e:
+                host.failures += 1
+                last_error = e
+                if attempt < len(urls) - 1:
+                    logger.warning(f"🎛️ {file_name}: {_host(url)} failed ({str(e)}), trying the next URL")
+            finally:
+                self.policy.finished(url, completed, time.monotonic() - url_started, plan["connections"])
+        if last_error is None:
+            raise SegmentedDownloadError("No download URL")
+        if isinstance(last_error, DownloadStalled):
+            raise SegmentedDownloadError(str(last_error))
+        raise last_error
+
+    async def _python(self, url, path, size, plan, on_progress, interval, timeout, can_switch, throttle):
+        downloader = SegmentedDownloader(
+            segments=plan["connections"], min_segment_size=plan["min_split_size"],
+            retries=self.segmented.retries, chunk_size=self.segmented.chunk_size
+        )
+
+        async def on_stall(level, status):
+            logger.warning(f"🎛️ No progress for {self.stall_seconds * level}s at {status['completed']} bytes")
+            if can_switch:
+                raise DownloadStalled(f"No progress for {self.stall_seconds * level}s")
+
+        return await downloader.download(
+            url, path, size, on_progress=self._watch(on_progress, on_stall), interval=interval, timeout=timeout,
+            throttle=throttle
+        )
+
+    async def _aria2(self, urls, directory, file_name, plan, on_progress, interval, timeout, can_switch, throttle):
+        # Every remaining URL goes in as a mirror; aria2 moves off ones slower than lowest_speed itself.
+        # With a single URL there's nowhere to move to, and the limit would just fail a slow download.
+        gid = await self.aria2.add(
+            urls, directory, file_name, connections=plan["connections"],
+            max_speed=throttle.rate if throttle and throttle.rate else None,
+            min_split_size=plan["min_split_size"], lowest_speed=self.lowest_speed if len(urls) > 1 else None
+        )
+        if throttle:
+            # aria2 paces itself; just keep its per-download limit on our share
+            throttle.on_change = lambda rate: self.aria2.set_job_limits(gid, max_speed=rate)
+        connections = plan["connections"]
+
+        async def on_stall(level, status):
+            nonlocal connections
+            if level == 1 and connections < self.policy.max_connections:
+                connections = min(self.policy.max_connections, connections * 2)
+                logger.warning(f"🎛️ {file_name} stalled, raising to {connections} connections")
+                await self.aria2.set_job_limits(gid, connections=connections)
+            elif level > 1 and can_switch:
+                await self.aria2.cancel(gid)
+                raise DownloadStalled(f"No progress for {self.stall_seconds * level}s")
+
+        try:
+            status = await self.aria2.wait(
+                gid, on_progress=self._watch(on_progress, on_stall), interval=interval, timeout=timeout
+            )
+        finally:
+            if throttle:
+                throttle.on_change = None
+        return status["completed"]
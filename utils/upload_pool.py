@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger("terabox_bot")
+
+# Files each Pyrogram client may upload at once (Pyrogram's default is 1). This doesn't
+# spread one file over more connections: Pyrogram already sends the parts of files over
+# 10 MB with 4 workers, and that count isn't configurable.
+UPLOAD_TRANSMISSIONS = int(os.getenv("UPLOAD_TRANSMISSIONS", 2))
+# Extra sessions that share the upload work, comma separated
+UPLOADER_BOT_TOKENS = [t.strip() for t in os.getenv("UPLOADER_BOT_TOKENS", "").split(",") if t.strip()]
+UPLOADER_SESSION_STRINGS = [s.strip() for s in os.getenv("UPLOADER_SESSION_STRINGS", "").split(",") if s.strip()]
+# Chat both the main bot and every helper can post to; helpers upload here first.
+# Keep it separate from LOG_CHANNEL_ID, or every helper upload shows up there twice.
+UPLOAD_STORAGE_CHAT_ID = os.getenv("UPLOAD_STORAGE_CHAT_ID")
+
+
+def build_helper_clients(api_id, api_hash):
+    """Pyrogram clients for the helper sessions configured in the environment"""
+    from pyrogram import Client
+
+    clients = []
+    for i, token in enumerate(UPLOADER_BOT_TOKENS):
+        clients.append(Client(
+            f"uploader_bot_{i}", api_id=api_id, api_hash=api_hash, bot_token=token,
+            in_memory=True, no_updates=True, max_concurrent_transmissions=UPLOAD_TRANSMISSIONS
+        ))
+    for i, session in enumerate(UPLOADER_SESSION_STRINGS):
+        clients.append(Client(
+            f"uploader_user_{i}", api_id=api_id, api_hash=api_hash, session_string=session,
+            in_memory=True, no_updates=True, max_concurrent_transmissions=UPLOAD_TRANSMISSIONS
+        ))
+    return clients
+
+
+class UploadPool:
+    """Spreads uploads over the main bot and any helper sessions
+
+    Helpers upload into ``storage_chat``; the main bot then re-sends that
+    message to the user by its own file_id, so users only ever talk to the
+    main bot. Clients are plain objects with Pyrogram's send_* interface,
+    which keeps the pool usable with mock clients.
+    """
+
+    def __init__(self, primary, helpers=(), storage_chat=UPLOAD_STORAGE_CHAT_ID, capacity=UPLOAD_TRANSMISSIONS):
+        self.primary = primary
+        self.helpers = list(helpers) if storage_chat else []
+        if helpers and not storage_chat:
+            logger.warning("Uploader sessions configured without UPLOAD_STORAGE_CHAT_ID, ignoring them")
+        self.storage_chat = int(storage_chat) if storage_chat and str(storage_chat).lstrip("-").isdigit() else storage_chat
+        self.capacity = max(1, capacity)
+        self.clients = [primary] + self.helpers
+        self._active = {id(c): 0 for c in self.clients}
+        self._uploads = {id(c): 0 for c in self.clients}
+        self._bytes = {id(c): 0 for c in self.clients}
+        self._started = False
+        self._start_lock = None
+
+    async def start(self):
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._started:
+                return
+            for client in list(self.helpers):
+                try:
+                    await client.start()
+                    logger.info(f"📤 Uploader session {client.name} ready")
+                except Exception as e:
+                    logger.error(f"Uploader session failed to start, dropping it: {str(e)}")
+                    self.helpers.remove(client)
+                    self.clients.remove(client)
+            self._started = True
+
+    async def stop(self):
+        if not self._started:
+            return
+        self._started = False
+        for client in self.helpers:
+            try:
+                await client.stop()
+            except Exception:
+                pass
+
+    def _pick(self):
+        return min(self.clients, key=lambda c: (self._active[id(c)] / self.capacity, c is not self.primary))
+
+    @asynccontextmanager
+    async def lease(self, size=0):
+        """Reserve the least-loaded client for one upload"""
+        if self.helpers and not self._started:
+            await self.start()
+        client = self._pick()
+        key = id(client)
+        self._active[key] += 1
+        try:
+            yield client
+            self._uploads[key] += 1
+            self._bytes[key] += size
+        finally:
+            self._active[key] -= 1
+
+    async def send(self, client, msg, kind, path, reply_markup=None, **kwargs):
+        """Upload ``path`` with ``client`` and deliver it to ``msg``'s chat through the main bot"""
+        if client is self.primary:
+            reply = msg.reply_video if kind == "video" else msg.reply_document
+            return await reply(path, reply_markup=reply_markup, **kwargs)
+
+        sender = client.send_video if kind == "video" else client.send_document
+        # The spoiler is for the user's copy, not the storage chat
+        has_spoiler = kwargs.pop("has_spoiler", None)
+        stored = await sender(self.storage_chat, path, **kwargs)
+        if not stored:
+            return None
+        # file_ids are per session, so look the message up as the main bot
+        copy = await self.primary.get_messages(self.storage_chat, stored.id)
+        if kind == "video" and copy.video:
+            # send_video takes a file_id too, and unlike send_cached_media it keeps the spoiler
+            return await self.primary.send_video(
+                msg.chat.id, copy.video.file_id,
+                caption=kwargs.get("caption"),
+                parse_mode=kwargs.get("parse_mode"),
+                has_spoiler=has_spoiler,
+                reply_markup=reply_markup
+            )
+        media = copy.video or copy.document
+        return await self.primary.send_cached_media(
+            chat_id=msg.chat.id,
+            file_id=media.file_id,
+            caption=kwargs.get("caption"),
+            parse_mode=kwargs.get("parse_mode"),
+            reply_markup=reply_markup
+        )
+
+    def stats(self):
+        return [
+            {
+                "name": getattr(c, "name", str(i)),
+                "active": self._active[id(c)],
+                "uploads": self._uploads[id(c)],
+                "bytes": self._bytes[id(c)],
+            }
+            for i, c in enumerate(self.clients)
+        ]
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+
+from pyrogram.errors import FloodWait, PeerIdInvalid, UserIdInvalid
+
+logger = logging.getLogger("terabox_bot")
+
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 3600))
+# Users Telegram won't resolve (never started the bot) are retried sooner
+USER_MISSING_TTL = int(os.getenv("USER_MISSING_TTL", 300))
+USERLIST_PAGE_SIZE = int(os.getenv("USERLIST_PAGE_SIZE", 20))
+# get_users accepts at most 200 IDs per call
+USERS_PER_REQUEST = 200
+# Seconds of FloodWait a batch of names may wait out in total before it's given up
+USER_FLOOD_WAIT = int(os.getenv("USER_FLOOD_WAIT", 30))
+
+
+class UserDirectory:
+    """Display names of users, fetched in batches and cached with a TTL"""
+
+    def __init__(self, client, ttl=USER_CACHE_TTL, missing_ttl=USER_MISSING_TTL,
+                 chunk_size=USERS_PER_REQUEST, concurrency=4):
+        self.client = client
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.chunk_size = max(1, min(chunk_size, USERS_PER_REQUEST))
+        self.concurrency = concurrency
+        self._cache = {}  # user_id -> (expires_at, name or None)
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    async def names(self, user_ids):
+        """{user_id: name} for ``user_ids``; None for users that couldn't be fetched"""
+        now = time.monotonic()
+        result, missing = {}, []
+        for user_id in user_ids:
+            cached = self._cache.get(user_id)
+            if cached and cached[0] > now:
+                self.hits += 1
+                result[user_id] = cached[1]
+            else:
+                self.misses += 1
+                missing.append(user_id)
+        if missing:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            skipped = set()
+
+            async def fetch(chunk):
+                async with semaphore:
+                    return await self._fetch(chunk, skipped)
+
+            chunks = [missing[i:i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)]
+            fetched = {}
+            for names in await asyncio.gather(*(fetch(chunk) for chunk in chunks)):
+                fetched.update(names)
+            now = time.monotonic()
+            for user_id in missing:
+                name = fetched.get(user_id)
+                # A batch that was never fetched says nothing about its users, don't cache it
+                if user_id not in skipped:
+                    self._cache[user_id] = (now + (self.ttl if name else self.missing_ttl), name)
+                result[user_id] = name
+        return result
+
+    async def _fetch(self, user_ids, skipped):
+        """One get_users call; a batch with unresolvable IDs is split until they're isolated
+
+        IDs of a batch that couldn't be fetched at all (long FloodWait, API error) go into ``skipped``.
+        """
+        waited = 0
+        while True:
+            self.requests += 1
+            try:
+                users = await self.client.get_users(user_ids)
+                break
+            except FloodWait as e:
+                if waited + e.value > USER_FLOOD_WAIT:
+                    logger.warning(f"FloodWait of {e.value}s fetching users, skipping {len(user_ids)} names")
+                    skipped.update(user_ids)
+                    return {}
+                waited += e.value
+                await asyncio.sleep(e.value)
+            except (PeerIdInvalid, UserIdInvalid, KeyError, ValueError) as e:
+                if len(user_ids) == 1:
+                    logger.warning(f"User ID {user_ids[0]} fetch failed: {str(e)}")
+                    return {}
+                middle = len(user_ids) // 2
+                first, second = await asyncio.gather(
+                    self._fetch(user_ids[:middle], skipped), self._fetch(user_ids[middle:], skipped)
+                )
+                return {**first, **second}
+            except Exception as e:
+                logger.warning(f"Fetching {len(user_ids)} users failed: {str(e)}")
+                skipped.update(user_ids)
+                return {}
+        return {user.id: user.first_name or "No name" for user in users}
+
+    def forget(self, user_id):
+        self._cache.pop(user_id, None)
+
+    def stats(self):
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses, "requests": self.requests}
+
+
+def paginate(items, page, page_size=USERLIST_PAGE_SIZE):
+    """(items on ``page``, clamped page, page count)"""
+    pages = max(1, -(-len(items) // page_size))
+    page = max(0, min(page, pages - 1))
+    return items[page * page_size:(page + 1) * page_size], page, pages
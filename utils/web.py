@@ -0,0 +1,111 @@
+import html
+import logging
+import os
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger("terabox_bot")
+
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", os.getenv("PORT", 8080)))
+# /debug/profile is only served when this is set, and only with ?token=<PROFILE_TOKEN>
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# /status only shows who is downloading what with ?token=<STATUS_TOKEN>; otherwise just progress
+STATUS_TOKEN = os.getenv("STATUS_TOKEN", "")
+
+STATUS_COLUMNS = ("user_id", "file_name", "stage", "position", "percent", "speed", "eta", "size")
+PRIVATE_COLUMNS = ("user_id", "file_name")
+
+
+def _status_html(jobs, columns=STATUS_COLUMNS):
+    rows = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(job.get(c, '')))}</td>" for c in columns) + "</tr>"
+        for job in jobs
+    )
+    head = "".join(f"<th>{c}</th>" for c in columns)
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"UTF-8\"><meta http-equiv=\"refresh\" content=\"5\">"
+        "<title>Active Jobs</title></head><body>"
+        f"<h3>Active jobs: {len(jobs)}</h3><table border=\"1\" cellpadding=\"4\">"
+        f"<tr>{head}</tr>{rows}</table></body></html>"
+    )
+
+
+class WebServer:
+    """Status pages served from the bot's own event loop
+
+    ``status`` returns a list of job dicts, ``health`` a (healthy, details)
+    tuple and ``metrics`` the Prometheus text; all are read per request.
+    ``profile(seconds)`` is awaited for /debug/profile and returns the path
+    of the written profile.
+    """
+
+    def __init__(self, status, health, metrics=None, profile=None, root=".", host=WEB_HOST, port=WEB_PORT):
+        self.status = status
+        self.health = health
+        self.metrics = metrics
+        self.profile = profile
+        self.root = root
+        self.host = host
+        self.port = port
+        self.started_at = time.time()
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_get("/", self.home)
+        self.app.router.add_get("/healthz", self.healthz)
+        self.app.router.add_get("/status", self.status_view)
+        if metrics:
+            self.app.router.add_get("/metrics", self.metrics_view)
+        if profile and PROFILE_TOKEN:
+            self.app.router.add_get("/debug/profile", self.profile_view)
+        static_dir = os.path.join(root, "static")
+        if os.path.isdir(static_dir):
+            self.app.router.add_static("/static", static_dir)
+
+    async def home(self, request):
+        return web.FileResponse(os.path.join(self.root, "templates", "index.html"))
+
+    async def healthz(self, request):
+        healthy, details = self.health()
+        details["uptime"] = int(time.time() - self.started_at)
+        return web.json_response(details, status=200 if healthy else 503)
+
+    async def status_view(self, request):
+        jobs = self.status()
+        columns = STATUS_COLUMNS
+        if not STATUS_TOKEN or request.query.get("token") != STATUS_TOKEN:
+            columns = tuple(c for c in STATUS_COLUMNS if c not in PRIVATE_COLUMNS)
+            jobs = [{c: job[c] for c in columns if c in job} for job in jobs]
+        wants_html = request.query.get("format") == "html" or (
+            "format" not in request.query and "text/html" in request.headers.get("Accept", "")
+        )
+        if wants_html:
+            return web.Response(text=_status_html(jobs, columns), content_type="text/html")
+        return web.json_response({"jobs": jobs, "count": len(jobs)})
+
+    async def metrics_view(self, request):
+        return web.Response(
+            body=self.metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    async def profile_view(self, request):
+        if request.query.get("token") != PROFILE_TOKEN:
+            return web.Response(status=403, text="forbidden")
+        seconds = request.query.get("seconds", "15")
+        try:
+            path, _ = await self.profile(int(seconds) if seconds.isdigit() else 15)
+        except RuntimeError as e:
+            return web.Response(status=409, text=str(e))
+        return web.FileResponse(path, headers={"Content-Disposition": f"attachment; filename={os.path.basename(path)}"})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"🌐 Web server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None